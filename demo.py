@@ -7,49 +7,53 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL']='3'
 
 import numpy as np
-from PIL import Image
-
-def load_img(path):
-    x = np.array(Image.open(path).convert('L'))
-    return x
-from csbdeep.utils import normalize
-
-from stardist.models import StarDist2D
-import matplotlib.pyplot as plt
-import pathlib
-import tensorflow as tf
-from utils_StarBub import HiddenReco, SaveCSV_List, BubbleStepper
-from tqdm import tqdm
-from stardist import random_label_cmap
-import matplotlib
-matplotlib.rcParams["image.interpolation"] = None
+from utils_FrameLoader import load_frame, normalizeFrame
+
+from utils_StarBub import HiddenReco
+from utils_Service import InferenceClient
+# TensorFlow/StarDist, matplotlib and the renderer are imported below only when they are used
 
 # Configuration
 base_dir = os.path.abspath('')
 Model_dir = base_dir + '/Models/'
 use_gpu = False  # Set to False if no GPU
-
-# Setup GPU/CPU
-if use_gpu:
-    physical_devices = tf.config.list_physical_devices('GPU')
-    for device in physical_devices:
-        tf.config.experimental.set_memory_growth(device, True)
-else:
-    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
-
-print("Loading models...")
-# Load models
-modelSD = StarDist2D(None, name='data_mix_64_400', basedir=Model_dir + 'SDmodel')
-
-# model = tf.keras.models.load_model(Model_dir + 'RDC/rdc_model.h5')
-model = tf.keras.models.load_model(Model_dir + 'RDC/rdc_model_mm.h5')
-
-print("Models loaded successfully!")
+useService = False  # Set to True to use a running inference service (python utils_Service.py) instead of loading the models here
 
 # Prediction configuration
 Metric = 5.2E-2  # Pixel size in mm
 useRDC = True    # Use RDC method
 boolplot = True  # Show results
+saveOverlay = False  # Set to True to write a headless QA overlay PNG (<name>_overlay.png) next to the CSV files
+
+client = None
+if useService:
+    client = InferenceClient()
+    if client.available():
+        print("Using inference service, skipping model loading")
+    else:
+        print("Inference service not reachable, loading models locally")
+        client = None
+
+if client is None:
+    import tensorflow as tf
+    from stardist.models import StarDist2D
+
+    # Setup GPU/CPU
+    if use_gpu:
+        physical_devices = tf.config.list_physical_devices('GPU')
+        for device in physical_devices:
+            tf.config.experimental.set_memory_growth(device, True)
+    else:
+        os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+
+    print("Loading models...")
+    # Load models
+    modelSD = StarDist2D(None, name='data_mix_64_400', basedir=Model_dir + 'SDmodel')
+
+    # model = tf.keras.models.load_model(Model_dir + 'RDC/rdc_model.h5')
+    model = tf.keras.models.load_model(Model_dir + 'RDC/rdc_model_mm.h5')
+
+    print("Models loaded successfully!")
 
 # Image path
 ImgDir = base_dir + '/Examples/img/frame_0180.png'
@@ -57,22 +61,43 @@ ImgDir = base_dir + '/Examples/img/frame_0180.png'
 print(f"Processing image: {ImgDir}")
 
 # Load and normalize image
-x = load_img(ImgDir)
-X = normalize(x if x.ndim == 2 else x[..., 0], 1, 99.8, axis=(0, 1))
+# Histogram percentiles, same result as csbdeep normalize(x, 1, 99.8, axis=(0, 1))
+# (use utils_FrameLoader.FrameSource to prefetch frames when processing a sequence)
+x = load_frame(ImgDir)
+X = normalizeFrame(x if x.ndim == 2 else x[..., 0], 1, 99.8)
 
 # Create mask with UNet
 # imgMask, imgIntersec = createLabelUNet(X, 2, netMask, 512, 300, ctxMask=ctx)
 
-# StarDist Prediction
-# labels, _ = combinedPrediction(X, modelSD, imgMask, imgIntersec)
-labels,_=modelSD.predict_instances(X,verbose=False)
-
-
-# Display results
+# StarDist Prediction + hidden part reconstruction
 VisualItems = []
 Bubbles = []
+collectVisuals = boolplot or saveOverlay
+
+if client is not None:
+    Bubbles, labels, visuals = client.predict_array(x, metric=Metric, useRDC=useRDC, return_labels=boolplot,
+                                                    return_visuals=collectVisuals)
+    VisualItems = visuals or []
+else:
+    # labels, _ = combinedPrediction(X, modelSD, imgMask, imgIntersec)
+    labels,_=modelSD.predict_instances(X,verbose=False)
+
+    if collectVisuals:
+        # Reconstruct bubbles (Get Data ONLY, do not plot yet)
+        # Note: We pass return_visuals=True to prevent blocking and get visual data back
+        Bubbles, VisualItems = HiddenReco(labels, Metric, useRDC=useRDC, model=model, boolPlot=True, return_visuals=True)
+    else:
+        Bubbles = HiddenReco(labels, Metric, useRDC=useRDC, model=model, boolPlot=False)
+
+print(f"Detected {len(Bubbles)} bubbles")
 
+# Display results
 if boolplot:
+    import matplotlib
+    import matplotlib.pyplot as plt
+    from stardist import random_label_cmap
+    from utils_Plot import BubbleStepper
+    matplotlib.rcParams["image.interpolation"] = None
     lbl_cmap = random_label_cmap()
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 5))
     
@@ -86,18 +111,6 @@ if boolplot:
     ax2.imshow(X, cmap='gray')
     ax2.set_axis_off() 
     ax2.set_title('Hidden part reconstruction')   
-    
-    # Reconstruct bubbles (Get Data ONLY, do not plot yet)
-    # Note: We pass return_visuals=True to prevent blocking and get visual data back
-    Bubbles, VisualItems = HiddenReco(labels, Metric, useRDC=useRDC, model=model, boolPlot=boolplot, ax=ax2, step_plot=True, return_visuals=True)
-    
-    # plt.tight_layout() # Move this to end
-    
-    print(f"Detected {len(Bubbles)} bubbles")
-
-else:
-    Bubbles = HiddenReco(labels, Metric, useRDC=useRDC, model=model, boolPlot=False)
-    print(f"Detected {len(Bubbles)} bubbles")
 
 # --- CSV Export ---
 print("Exporting results to CSV...")
@@ -176,6 +189,13 @@ try:
 except Exception as e:
     print(f"Error exporting CSV: {e}")
 
+# --- QA Overlay (headless) ---
+if saveOverlay and VisualItems:
+    from utils_Render import renderOverlay, OverlayWriter
+    with OverlayWriter(output_dir) as writer:
+        writer.write(renderOverlay(X, VisualItems, draw_rays=True), name=f"{img_name}_overlay")
+    print(f"Saved overlay to:\n  {os.path.join(output_dir, img_name + '_overlay.png')}")
+
 # --- Visualization (Launching GUI) ---
 if boolplot and VisualItems:
     print("Launching interactive viewer...")
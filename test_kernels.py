@@ -0,0 +1,44 @@
+""" Parity of the numba kernels, their NumPy fallbacks and the ROI paths (python -m pytest). """
+
+import numpy as np
+import pytest
+import utils_Kernels as kernels
+from utils_Segmentation import dilateToMask
+from utils_StarBub import labelRays
+
+
+def _scene(seed, H=160, W=200):
+    rng = np.random.default_rng(seed)
+    labels = np.zeros((H, W), dtype=np.int32)
+    yy, xx = np.mgrid[:H, :W]
+    for lbl in range(1, 12):
+        cy, cx = rng.uniform(-5, H + 5), rng.uniform(-5, W + 5)
+        ry, rx = rng.uniform(2, 25, size=2)
+        labels[((yy - cy) / ry)**2 + ((xx - cx) / rx)**2 < 1] = lbl
+    mask = (labels > 0) | (rng.random((H, W)) > 0.3)
+    inter = rng.random((H, W)) > 0.97
+    return labels, mask.astype(np.uint8), inter.astype(np.uint8)
+
+
+def test_numba_matches_numpy():
+    if kernels.backend() != 'numba':
+        pytest.skip("numba not available")
+    assert kernels.checkParity()
+
+
+def test_numpy_kernels(monkeypatch):
+    monkeypatch.setattr(kernels, 'backend', lambda: 'numpy')
+    assert kernels.checkParity(num_trials=5)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_roi_matches_full_frame(seed):
+    labels, mask, inter = _scene(seed)
+    full, roi = labelRays(labels, margin=None), labelRays(labels)
+    assert [r.id for r in full] == [r.id for r in roi]
+    for a, b in zip(full, roi):
+        assert a.center == b.center
+        np.testing.assert_array_equal(a.points, b.points)
+        np.testing.assert_array_equal(a.dists, b.dists)
+    np.testing.assert_array_equal(dilateToMask(labels, mask, inter, roi=True),
+                                  dilateToMask(labels, mask, inter, roi=False))
@@ -0,0 +1,87 @@
+import numpy as np
+
+
+def rayVertices(dists, centers=None):
+    """ Polygon vertices (y,x) of an (N, n_rays) ray matrix, same ray angles as RDObj.
+
+    Without centers the vertices are relative to each ray origin.
+    """
+    dists = np.atleast_2d(np.asarray(dists, dtype=np.float64))
+    phis = np.linspace(0, 2 * np.pi, dists.shape[1], endpoint=False)
+    ys = dists * np.sin(phis)
+    xs = dists * np.cos(phis)
+    if centers is not None:
+        centers = np.atleast_2d(np.asarray(centers, dtype=np.float64))
+        ys = ys + centers[:, 0:1]
+        xs = xs + centers[:, 1:2]
+    return ys, xs
+
+
+def rayArea(dists):
+    """ Polygon area of each row of an (N, n_rays) ray matrix (as in calculate_area_accuracy). """
+    dists = np.atleast_2d(dists)
+    d_theta = 2 * np.pi / dists.shape[1]
+    return 0.5 * np.sum(dists * np.roll(dists, -1, axis=1) * np.sin(d_theta), axis=1)
+
+
+def areaAccuracy(Y_true, Y_pred):
+    """ Per sample area accuracy min(A_pred, A_gt) / max(A_pred, A_gt) of two ray matrices. """
+    area_gt = np.maximum(rayArea(Y_true), 1e-10)
+    area_pred = np.maximum(rayArea(Y_pred), 1e-10)
+    return np.minimum(area_pred, area_gt) / np.maximum(area_pred, area_gt)
+
+
+def rayDescriptors(dists, centers=None, metric=1.0):
+    """ Shape descriptors of all bubbles at once from their ray matrix.
+
+    Principal axes follow from the second moments of the ray polygon: the semi-axes of the
+    ellipse with the same moments are 2*sqrt(eigenvalues of the covariance).
+
+    Parameters
+    ----------
+    dists : ndarray
+        (N, n_rays) ray lengths in pixels, ray k at angle 2*pi*k/n_rays as in RDObj.
+    centers: ndarray
+        (N, 2) ray origins (y,x) in pixels, only needed for Position/Centroid.
+    metric: float
+        Real pixel size to calculate physical sizes.
+
+    Returns
+    -------
+    dict
+        Arrays of length N: Area, Perimeter, EqDiameter, Major, Minor (semi-axes like Bubble),
+        Orientation (major axis angle in rad from the x axis towards +y), Volume and Diameter
+        (spheroidal, as in Bubble) in physical units, plus Position and Centroid (y,x) in pixels.
+    """
+    ys, xs = rayVertices(dists)
+    ys1 = np.roll(ys, -1, axis=1)
+    xs1 = np.roll(xs, -1, axis=1)
+    cross = xs * ys1 - xs1 * ys
+    A = 0.5 * np.sum(cross, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cy = np.sum((ys + ys1) * cross, axis=1) / (6 * A)
+        cx = np.sum((xs + xs1) * cross, axis=1) / (6 * A)
+        mxx = np.sum((xs**2 + xs * xs1 + xs1**2) * cross, axis=1) / (12 * A) - cx**2
+        myy = np.sum((ys**2 + ys * ys1 + ys1**2) * cross, axis=1) / (12 * A) - cy**2
+        mxy = np.sum((xs * ys1 + 2 * xs * ys + 2 * xs1 * ys1 + xs1 * ys) * cross, axis=1) / (24 * A) - cx * cy
+    half_trace = (mxx + myy) / 2
+    root = np.sqrt(((mxx - myy) / 2)**2 + mxy**2)
+    major = 2 * np.sqrt(np.maximum(half_trace + root, 0)) * metric
+    minor = 2 * np.sqrt(np.maximum(half_trace - root, 0)) * metric
+    area = np.abs(A)
+    volume = np.pi * 4 / 3 * major**2 * minor
+    props = {
+        'Area': area * metric**2,
+        'Perimeter': np.sum(np.hypot(xs1 - xs, ys1 - ys), axis=1) * metric,
+        'EqDiameter': np.sqrt(4 * area / np.pi) * metric,
+        'Major': major,
+        'Minor': minor,
+        'Orientation': 0.5 * np.arctan2(2 * mxy, mxx - myy),
+        'Volume': volume,
+        'Diameter': (6 * volume / np.pi)**(1 / 3),
+    }
+    if centers is not None:
+        centers = np.atleast_2d(np.asarray(centers, dtype=np.float64))
+        props['Position'] = centers
+        props['Centroid'] = centers + np.stack([cy, cx], axis=1)
+    return props
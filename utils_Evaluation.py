@@ -0,0 +1,224 @@
+import os
+import csv
+import glob
+import random
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from utils_FrameLoader import FrameSource
+from utils_StarBub import RDObj, Bubble, labelRays, predictRays, rdcResults
+
+OCCLUSION_BINS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+# Per worker process state, set by _initWorker
+_model = None
+_gt_index = None
+
+
+def load_mask(path):
+    return np.array(Image.open(path))
+
+
+def _loadMaskOrEmpty(path):
+    try:
+        return load_mask(path)
+    except Exception as e:
+        print(f"Error processing {path}: {e}")
+        return np.zeros((0, 0), dtype=np.int32)
+
+
+def gtProperties(src_arr, n_rays=64):
+    """ GT area (in pixels^2, as get_gt_properties in rdc-data-gen), pixel count and rays of a bubble. """
+    gt_mask = np.zeros_like(src_arr, dtype=int)
+    gt_mask[src_arr] = 1
+    gt_rdc = RDObj(1, n_rays)
+    gt_rdc.generateRD_manual(gt_mask)
+    pixel_count = np.count_nonzero(src_arr)
+    if gt_rdc.center is None:
+        return np.nan, pixel_count, np.full(n_rays, np.nan)
+    gt_bubble = Bubble(gt_rdc.points, 1.0, ID=1)
+    if gt_bubble.Diameter is None:
+        return np.nan, pixel_count, gt_rdc.dists
+    area = np.pi * (gt_bubble.Major / 2) * (gt_bubble.Minor / 2)
+    return area, pixel_count, gt_rdc.dists
+
+
+def _gtEntry(path):
+    return gtProperties(np.array(Image.open(path)) > 128)
+
+
+def buildGTIndex(unique_dir, index_path=None, n_workers=None):
+    """ Computes the GT descriptors of every unique bubble once and stores them on disk.
+
+    The areas are stored in pixels^2; the area accuracy is a ratio, so the index is valid for
+    every metric. An existing index is reused and only extended by new bubbles.
+
+    Returns the index as dict name -> (area_px, pixel_count).
+    """
+    if index_path is None:
+        index_path = os.path.join(unique_dir, 'gt_index.npz')
+    names = sorted(os.path.basename(p) for p in glob.glob(os.path.join(unique_dir, '*.png')))
+    index = {}
+    if os.path.exists(index_path):
+        index = loadGTIndex(index_path, with_rays=True)
+    missing = [n for n in names if n not in index]
+    if missing:
+        print(f"Building GT index for {len(missing)} bubbles...")
+        paths = [os.path.join(unique_dir, n) for n in missing]
+        # spawn as the evaluation pool: forking a process that has imported TensorFlow can deadlock
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(n_workers, mp_context=ctx) as ex:
+            for name, entry in zip(missing, ex.map(_gtEntry, paths, chunksize=256)):
+                index[name] = entry
+        keys = sorted(index)
+        np.savez(index_path, names=np.array(keys),
+                 area=np.array([index[k][0] for k in keys], dtype=np.float64),
+                 pixel_count=np.array([index[k][1] for k in keys], dtype=np.int64),
+                 dists=np.array([index[k][2] for k in keys], dtype=np.float64))
+    return {k: v[:2] for k, v in index.items()}
+
+
+def loadGTIndex(index_path, with_rays=False):
+    data = np.load(index_path)
+    if with_rays:
+        return {n: (a, c, d) for n, a, c, d in zip(data['names'], data['area'], data['pixel_count'], data['dists'])}
+    return {n: (a, c) for n, a, c in zip(data['names'], data['area'], data['pixel_count'])}
+
+
+def readSampleCSV(csv_path):
+    """ Reads the pixel_value,source_bubble,r,c[,alpha] metadata of a synthetic mask. """
+    with open(csv_path, newline='') as f:
+        rows = [r for r in csv.DictReader(f, skipinitialspace=True)]
+    return {int(r['pixel_value']): r for r in rows if r['source_bubble'] != 'background'}
+
+
+def reconstructBatch(label_images, model, metric, n_rays=64):
+    """ RDC reconstruction of several label images with one batched model call.
+
+    Same result as reconstructBubbles(labels, metric, model) for each image.
+    """
+    objs_per_image = [labelRays(labels, n_rays) for labels in label_images]
+    rays = iter(predictRays([Rdc for objs in objs_per_image for Rdc in objs], model, metric))
+    results = []
+    for labels, objs in zip(label_images, objs_per_image):
+        pixel_counts = np.bincount(np.asarray(labels).ravel())
+        results.append(rdcResults(objs, [next(rays) for _ in objs], pixel_counts, metric))
+    return results
+
+
+def _initWorker(model_path, index_path):
+    global _model, _gt_index
+    # Before TensorFlow is imported: CPU only, n_workers processes would each grab the whole GPU
+    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    _model = tf.keras.models.load_model(model_path)
+    _gt_index = loadGTIndex(index_path)
+
+
+def evaluateChunk(csv_paths, mask_dir, metric, model=None, gt_index=None):
+    """ Evaluates a chunk of synthetic samples.
+
+    The masks are decoded by a FrameSource while the CSV metadata is read.
+    Returns a list of (sample, alpha, occlusion, accuracy) records, one per predicted bubble.
+    """
+    model = model if model is not None else _model
+    gt_index = gt_index if gt_index is not None else _gt_index
+    pairs = [(csv_path, os.path.join(mask_dir, os.path.basename(csv_path).replace('.csv', '.png')))
+             for csv_path in csv_paths]
+    pairs = [(csv_path, mask_path) for csv_path, mask_path in pairs if os.path.exists(mask_path)]
+    masks = FrameSource([mask_path for _, mask_path in pairs], loader=_loadMaskOrEmpty, normalize=False)
+    samples, label_images = [], []
+    for (csv_path, _), (_, labels) in zip(pairs, masks):
+        if labels.size == 0:
+            continue
+        try:
+            samples.append((csv_path, readSampleCSV(csv_path)))
+            label_images.append(labels)
+        except Exception as e:
+            print(f"Error processing {csv_path}: {e}")
+    records = []
+    for (csv_path, meta), bubbles in zip(samples, reconstructBatch(label_images, model, metric)):
+        sample = os.path.basename(csv_path)
+        for bub in bubbles:
+            row = meta.get(bub.ID)
+            if row is None or row['source_bubble'] not in gt_index:
+                continue
+            gt_area, gt_count = gt_index[row['source_bubble']]
+            if np.isnan(gt_area):
+                continue
+            gt_area = gt_area * metric**2
+            pred_area = np.pi * (bub.Major / 2) * (bub.Minor / 2)
+            acc = 0 if max(pred_area, gt_area) == 0 else min(pred_area, gt_area) / max(pred_area, gt_area)
+            if np.isnan(acc):
+                continue
+            occlusion = 1 - bub.PixelCount / gt_count if gt_count > 0 else np.nan
+            records.append((sample, row.get('alpha') or 'n/a', occlusion, acc))
+    return records
+
+
+def summarizeRecords(records, occlusion_bins=OCCLUSION_BINS):
+    """ Mean area accuracy over samples and broken down by alpha and occlusion ratio. """
+    per_sample = {}
+    for sample, _, _, acc in records:
+        per_sample.setdefault(sample, []).append(acc)
+    summary = {'mean': np.nanmean([np.mean(v) for v in per_sample.values()]) if per_sample else np.nan,
+               'num_samples': len(per_sample), 'num_bubbles': len(records), 'by_alpha': {}, 'by_occlusion': {}}
+    groups = {}
+    for _, alpha, _, acc in records:
+        groups.setdefault(alpha, []).append(acc)
+    summary['by_alpha'] = {a: (np.mean(v), len(v)) for a, v in sorted(groups.items())}
+    occ = np.array([r[2] for r in records], dtype=float)
+    accs = np.array([r[3] for r in records], dtype=float)
+    bins = np.digitize(occ, occlusion_bins[1:-1])
+    for b in range(len(occlusion_bins) - 1):
+        sel = bins == b
+        if np.any(sel):
+            key = f"{occlusion_bins[b]:.1f}-{occlusion_bins[b + 1]:.1f}"
+            summary['by_occlusion'][key] = (np.mean(accs[sel]), int(np.count_nonzero(sel)))
+    return summary
+
+
+def printSummary(summary):
+    print(f"\nEvaluation Complete. {summary['num_samples']} samples, {summary['num_bubbles']} bubbles.")
+    print(f"Mean Area Accuracy (RDObj-based): {summary['mean']:.4f}")
+    print("\n--- Accuracy by Alpha ---")
+    for alpha, (acc, n) in summary['by_alpha'].items():
+        print(f"  alpha={alpha}: {acc:.4f} ({n} bubbles)")
+    print("\n--- Accuracy by Occlusion Ratio ---")
+    for key, (acc, n) in summary['by_occlusion'].items():
+        print(f"  {key}: {acc:.4f} ({n} bubbles)")
+
+
+def evaluate_rdc_full(rdc_dir, unique_dir, model_path, metric, num_samples=None, n_workers=None,
+                      chunk_size=64, index_path=None, seed=None):
+    """ Evaluates the RDC model on all (or num_samples random) synthetic samples.
+
+    GT descriptors come from the on-disk index of buildGTIndex, samples are evaluated in a
+    process pool, each worker loading the model once and predicting a whole chunk at once.
+    """
+    if index_path is None:
+        index_path = os.path.join(unique_dir, 'gt_index.npz')
+    buildGTIndex(unique_dir, index_path, n_workers)
+    mask_dir = os.path.join(rdc_dir, 'Masks')
+    csv_files = sorted(glob.glob(os.path.join(mask_dir, '*.csv')))
+    if len(csv_files) == 0:
+        print("No data found.")
+        return None
+    if num_samples is not None:
+        csv_files = random.Random(seed).sample(csv_files, min(len(csv_files), num_samples))
+    chunks = [csv_files[i:i + chunk_size] for i in range(0, len(csv_files), chunk_size)]
+    print(f"Evaluating RDC model on {len(csv_files)} samples with Metric={metric}...")
+    records = []
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(n_workers, mp_context=ctx, initializer=_initWorker,
+                             initargs=(model_path, index_path)) as ex:
+        futures = [ex.submit(evaluateChunk, chunk, mask_dir, metric) for chunk in chunks]
+        for fut in futures:
+            records.extend(fut.result())
+    summary = summarizeRecords(records)
+    printSummary(summary)
+    return summary
@@ -0,0 +1,144 @@
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import queue
+
+
+def load_frame(path):
+    """ Loads a frame as grey values, keeping 16 bit data as uint16.
+
+    32 bit integer frames (Pillow mode 'I', which it also uses for many 16 bit PNGs) become uint16
+    if their values fit, float frames (mode 'F') and other integer ranges float32; convert('L')
+    would clip them to 8 bit.
+    """
+    from PIL import Image
+    img = Image.open(path)
+    if img.mode.startswith('I;16'):
+        return np.array(img)
+    if img.mode in ('I', 'F'):
+        x = np.asarray(img)
+        if x.dtype.kind in 'iu' and x.size and x.min() >= 0 and x.max() <= np.iinfo(np.uint16).max:
+            return x.astype(np.uint16)
+        return x.astype(np.float32)
+    return np.array(img.convert('L'))
+
+
+def histPercentile(x, q):
+    """ Percentiles of an uint8/uint16 image from its histogram.
+
+    Gives the same values as np.percentile(x, q) (linear interpolation) without sorting
+    or partitioning the frame.
+    """
+    q = np.atleast_1d(np.true_divide(q, 100))
+    counts = np.bincount(x.ravel(), minlength=256 if x.dtype == np.uint8 else 65536)
+    cum = np.cumsum(counts)
+    n = cum[-1]
+    virtual = q * (n - 1)
+    lo = np.floor(virtual)
+    t = virtual - lo
+    a = np.searchsorted(cum, lo, side='right').astype(np.float64)
+    b = np.searchsorted(cum, np.minimum(lo + 1, n - 1), side='right').astype(np.float64)
+    # Same lerp as numpy to stay bitwise identical
+    diff = b - a
+    res = np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+    return res
+
+
+def normalizeFrame(x, pmin=1, pmax=99.8, out=None, eps=1e-20):
+    """ Percentile normalization equivalent to csbdeep normalize(x, pmin, pmax, axis=(0,1)).
+
+    Parameters
+    ----------
+    x : ndarray
+        2D frame. uint8/uint16 frames use histogram percentiles, other dtypes np.percentile.
+    pmin, pmax: float
+        Lower and upper percentile.
+    out: ndarray
+        Optional float32 buffer of the frame shape to write the result into.
+    """
+    if x.dtype in (np.uint8, np.uint16):
+        mi, ma = histPercentile(x, (pmin, pmax))
+    else:
+        mi, ma = np.percentile(x, (pmin, pmax))
+    mi, ma, eps = np.float32(mi), np.float32(ma), np.float32(eps)
+    if out is None or out.shape != x.shape:
+        out = np.empty(x.shape, dtype=np.float32)
+    out[...] = x
+    out -= mi
+    out /= (ma - mi + eps)
+    return out
+
+
+class FrameSource:
+    """ Iterates over normalized frames that are decoded ahead in a bounded thread pool.
+
+    Parameters
+    ----------
+    paths : list or FrameDataset
+        Frame file paths in processing order, or a utils_FrameStore dataset (frames are then
+        read from the memory-mapped chunks and yielded with their names or indices).
+    pmin, pmax: float
+        Percentiles used by normalizeFrame.
+    num_workers: int
+        Decoding threads.
+    prefetch: int
+        Maximum number of frames decoded ahead of the consumer.
+    loader: callable
+        Function path -> 2D ndarray, defaults to load_frame.
+    normalize: bool
+        False yields the frames as decoded (e.g. label images), only prefetched.
+
+    Yields (path, X) tuples. X is a reused float32 buffer that is only valid until the
+    next frame is requested, copy it to keep it.
+    """
+
+    def __init__(self, paths, pmin=1, pmax=99.8, num_workers=2, prefetch=4, loader=None, normalize=True):
+        if hasattr(paths, 'read_frame'):
+            loader = loader or paths.read_frame
+            paths = paths.keys()
+        self.paths = list(paths)
+        self.pmin = pmin
+        self.pmax = pmax
+        self.num_workers = num_workers
+        self.prefetch = max(1, prefetch)
+        self.loader = loader or load_frame
+        self.normalize = normalize
+        self.buffers = queue.SimpleQueue()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _load(self, path):
+        x = self.loader(path)
+        if x.ndim == 3:
+            x = x[..., 0]
+        if not self.normalize:
+            return path, x
+        try:
+            buf = self.buffers.get_nowait()
+        except queue.Empty:
+            buf = None
+        return path, normalizeFrame(x, self.pmin, self.pmax, out=buf)
+
+    def __iter__(self):
+        paths = iter(self.paths)
+        pending = deque()
+        held = None
+        with ThreadPoolExecutor(self.num_workers) as ex:
+            try:
+                for path in paths:
+                    pending.append(ex.submit(self._load, path))
+                    if len(pending) >= self.prefetch:
+                        break
+                while pending:
+                    path, X = pending.popleft().result()
+                    if held is not None and self.normalize:
+                        self.buffers.put(held)
+                    for nxt in paths:
+                        pending.append(ex.submit(self._load, nxt))
+                        break
+                    held = X
+                    yield path, X
+            finally:
+                for fut in pending:
+                    fut.cancel()
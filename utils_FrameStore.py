@@ -0,0 +1,329 @@
+"""
+Chunked, memory-mapped frame container for long camera sequences.
+
+A store is a directory with an index.json and one sub directory per dataset (e.g. raw, labels,
+preprocessed variants). Each dataset holds frames of one shape and dtype in fixed size chunks,
+every chunk being a plain .npy file of shape (chunk_frames, H, W):
+
+    store/
+        index.json
+        raw/chunk_000000.npy, raw/chunk_000001.npy, ...
+        labels/chunk_000000.npy, ...
+
+Frames are read zero-copy from the memory-mapped chunks, so opening a sequence with 150k frames
+costs a few file opens instead of 150k PNG decodes.
+
+    store = FrameStore.fromDirectory('data/frames', 'data/frames.store')
+    raw = store['raw']
+    x = raw[180]                  # read-only view into the chunk
+    labels = store.require('labels', raw.shape, np.int32)
+    labels[180] = prediction
+"""
+
+import os
+import glob
+import json
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from utils_FrameLoader import load_frame
+
+INDEX_FILE = 'index.json'
+DEFAULT_CHUNK_FRAMES = 256
+IMAGE_PATTERNS = ('*.png', '*.tif', '*.tiff', '*.jpg', '*.jpeg', '*.bmp')
+
+
+class FrameDataset:
+    """ Sequence of equally shaped frames stored in memory-mapped chunks.
+
+    Supports len(), integer and slice indexing (views if the range lies in one chunk, copies
+    otherwise), item assignment and append. Frames can also be addressed by their source file
+    name with read_frame.
+    """
+
+    def __init__(self, store, name, meta):
+        self.store = store
+        self.name = name
+        self.meta = meta
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunk_frames = meta['chunk_frames']
+        self.path = os.path.join(store.path, name)
+        self._chunks = {}
+        self._name_index = None
+
+    def __len__(self):
+        return self.meta['count']
+
+    @property
+    def names(self):
+        return self.meta['names']
+
+    def _chunkPath(self, c):
+        return os.path.join(self.path, f"chunk_{c:06d}.npy")
+
+    def _chunk(self, c, create=False):
+        chunk = self._chunks.get(c)
+        if chunk is None or (create and not chunk.flags.writeable):
+            path = self._chunkPath(c)
+            if os.path.exists(path):
+                mode = 'r+' if self.store.writable else 'r'
+                chunk = np.load(path, mmap_mode=mode)
+            elif create:
+                chunk = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype,
+                                                  shape=(self.chunk_frames,) + self.shape)
+            else:
+                return None
+            self._chunks[c] = chunk
+        return chunk
+
+    def _frame(self, i):
+        chunk = self._chunk(i // self.chunk_frames)
+        if chunk is None:
+            return np.zeros(self.shape, dtype=self.dtype)
+        frame = chunk[i % self.chunk_frames]
+        if frame.flags.writeable:
+            frame = frame.view()
+            frame.flags.writeable = False
+        return frame
+
+    def __getitem__(self, index):
+        n = len(self)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(n)
+            if step == 1 and stop > start and start // self.chunk_frames == (stop - 1) // self.chunk_frames:
+                chunk = self._chunk(start // self.chunk_frames)
+                if chunk is not None:
+                    c0 = start // self.chunk_frames * self.chunk_frames
+                    view = chunk[start - c0:stop - c0].view()
+                    view.flags.writeable = False
+                    return view
+            return np.stack([self._frame(i) for i in range(start, stop, step)]) if stop > start else \
+                np.empty((0,) + self.shape, dtype=self.dtype)
+        i = int(index)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(f"frame {index} out of range for dataset '{self.name}' with {n} frames")
+        return self._frame(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._frame(i)
+
+    def __setitem__(self, index, frame):
+        # Negative indices count from the end, indices >= len grow the dataset (e.g. labels
+        # written in processing order next to a raw dataset)
+        if not self.store.writable:
+            raise IOError(f"Frame store {self.store.path} is opened read-only")
+        frame = np.asarray(frame)
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match dataset '{self.name}' {self.shape}")
+        n = len(self)
+        i = int(index)
+        if i < 0:
+            i += n
+        if i < 0:
+            raise IndexError(f"frame {index} out of range for dataset '{self.name}' with {n} frames")
+        self._chunk(i // self.chunk_frames, create=True)[i % self.chunk_frames] = frame
+        if i >= self.meta['count']:
+            self.meta['names'].extend([None] * (i + 1 - self.meta['count']))
+            self.meta['count'] = i + 1
+
+    def append(self, frame, name=None):
+        i = len(self)
+        self[i] = frame
+        self.meta['names'][i] = name
+        self._name_index = None
+        return i
+
+    def keys(self):
+        """ Frame names if every frame has one, else the frame indices. """
+        names = self.names
+        if names and all(n is not None for n in names):
+            return list(names)
+        return list(range(len(self)))
+
+    def read_frame(self, key):
+        """ Frame by index or source file name. """
+        if isinstance(key, str):
+            if self._name_index is None:
+                self._name_index = {n: i for i, n in enumerate(self.names) if n is not None}
+            key = self._name_index[key]
+        return self[key]
+
+    def flush(self):
+        for chunk in self._chunks.values():
+            if isinstance(chunk, np.memmap) and chunk.flags.writeable:
+                chunk.flush()
+
+
+class FrameStore:
+    """ Directory of named frame datasets with a JSON index.
+
+    Parameters
+    ----------
+    path : str
+        Store directory.
+    mode: str
+        'r' read-only, 'a' read/write (the store is created if missing).
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.writable = mode != 'r'
+        self.lock = threading.Lock()
+        self._datasets = {}
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+        elif self.writable:
+            os.makedirs(path, exist_ok=True)
+            self.index = {'version': 1, 'datasets': {}}
+            self.flush()
+        else:
+            raise FileNotFoundError(f"No frame store at {path}")
+
+    def __contains__(self, name):
+        return name in self.index['datasets']
+
+    def __getitem__(self, name):
+        if name not in self._datasets:
+            if name not in self:
+                raise KeyError(f"Dataset '{name}' not in frame store {self.path}")
+            self._datasets[name] = FrameDataset(self, name, self.index['datasets'][name])
+        return self._datasets[name]
+
+    def datasets(self):
+        return list(self.index['datasets'])
+
+    def create(self, name, shape, dtype, chunk_frames=DEFAULT_CHUNK_FRAMES):
+        """ New empty dataset of frames with the given shape and dtype. """
+        if not self.writable:
+            raise IOError(f"Frame store {self.path} is opened read-only")
+        if name in self:
+            raise ValueError(f"Dataset '{name}' already exists in {self.path}")
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        self.index['datasets'][name] = {'shape': [int(s) for s in shape], 'dtype': np.dtype(dtype).str,
+                                        'chunk_frames': int(chunk_frames), 'count': 0, 'names': []}
+        return self[name]
+
+    def require(self, name, shape, dtype, chunk_frames=DEFAULT_CHUNK_FRAMES):
+        """ Existing dataset (shape and dtype must match) or a new one, e.g. labels next to raw. """
+        if name in self:
+            ds = self[name]
+            if ds.shape != tuple(shape) or ds.dtype != np.dtype(dtype):
+                raise ValueError(f"Dataset '{name}' has shape {ds.shape} and dtype {ds.dtype}")
+            return ds
+        return self.create(name, shape, dtype, chunk_frames)
+
+    def flush(self):
+        """ Writes the chunks and the index (atomically) to disk. """
+        with self.lock:
+            for ds in self._datasets.values():
+                ds.flush()
+            tmp = os.path.join(self.path, INDEX_FILE + '.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+    def close(self):
+        if self.writable:
+            self.flush()
+        self._datasets.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def fromDirectory(cls, src_dir, store_path, dataset='raw', patterns=IMAGE_PATTERNS,
+                      chunk_frames=DEFAULT_CHUNK_FRAMES, loader=None, num_workers=4):
+        """ Converts a directory of images into a dataset of a (new or existing) store.
+
+        Frames are decoded in a thread pool and stored in sorted file name order; the file names
+        are kept so frames can still be addressed by name.
+        """
+        paths = sorted(p for pattern in patterns for p in glob.glob(os.path.join(src_dir, pattern)))
+        if len(paths) == 0:
+            raise FileNotFoundError(f"No images found in {src_dir}")
+        return cls.fromFiles(paths, store_path, dataset, chunk_frames, loader, num_workers)
+
+    @classmethod
+    def fromFiles(cls, paths, store_path, dataset='raw', chunk_frames=DEFAULT_CHUNK_FRAMES, loader=None,
+                  num_workers=4):
+        """ As fromDirectory for an explicit list of image files. """
+        loader = loader or load_frame
+        store = cls(store_path, mode='a')
+
+        def _load(path):
+            x = loader(path)
+            return x[..., 0] if x.ndim == 3 else x
+
+        with ThreadPoolExecutor(num_workers) as ex:
+            ds = None
+            for path, x in zip(paths, ex.map(_load, paths)):
+                if ds is None:
+                    ds = store.require(dataset, x.shape, x.dtype, chunk_frames)
+                ds.append(x, os.path.basename(path))
+        store.flush()
+        return store
+
+
+def _fingerprint(path):
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_mtime, st.st_size]
+
+
+def imagePairs(image_files, mask_files, store_path, loader=None, chunk_frames=64):
+    """ Images and masks (lists in file order) read through a frame store, e.g. for training.
+
+    Pairs missing from the store are decoded once with loader and appended, later calls read
+    them from the memory-mapped chunks. A dataset holds one frame shape, so annotation images
+    of different sizes go to one images_<H>x<W>_<dtype>/masks_<H>x<W>_<dtype> pair per shape
+    (masks stored as int32), addressed by the image file name. The source path, mtime and size
+    of both files are kept in the index ('pairs'), a pair whose files differ (e.g. another mask
+    set) is decoded again and replaces the stored one.
+    """
+    loader = loader or load_frame
+    store = FrameStore(store_path, mode='a')
+    sources = store.index.setdefault('pairs', {})
+    where = {}
+    for name in store.datasets():
+        if name.startswith('images_'):
+            for i, key in enumerate(store[name].names):
+                if key is not None:
+                    where[key] = (name[len('images_'):], i)
+    X, Y = [], []
+    for image_file, mask_file in zip(image_files, mask_files):
+        key = os.path.basename(image_file)
+        source = {'image': _fingerprint(image_file), 'mask': _fingerprint(mask_file)}
+        if key not in where or sources.get(key) != source:
+            x, y = loader(image_file), loader(mask_file)
+            if x.shape[:2] != y.shape[:2]:
+                raise ValueError(f"Image {image_file} {x.shape} and mask {mask_file} {y.shape} differ in size")
+            suffix = f"{'x'.join(str(s) for s in x.shape)}_{x.dtype.name}"
+            images = store.require('images_' + suffix, x.shape, x.dtype, chunk_frames)
+            masks = store.require('masks_' + suffix, y.shape, np.int32, chunk_frames)
+            if key in where and where[key][0] == suffix:
+                i = where[key][1]
+                images[i] = x
+                masks[i] = y.astype(np.int32)
+            else:
+                if key in where:
+                    # Stored with another shape: orphan the old frames, they are no longer found by name
+                    old, i = where[key]
+                    for ds in (store['images_' + old], store['masks_' + old]):
+                        ds.names[i] = None
+                        ds._name_index = None
+                where[key] = (suffix, images.append(x, key))
+                masks.append(y.astype(np.int32), key)
+            sources[key] = source
+        suffix, i = where[key]
+        X.append(store['images_' + suffix][i])
+        Y.append(store['masks_' + suffix][i])
+    store.flush()
+    return X, Y
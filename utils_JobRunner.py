@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Sharded, resumable batch runner for frame -> StarDist -> bubble reconstruction jobs on several
+nodes that share a filesystem. There is no server, the job directory is the work queue:
+
+    job/
+        job.json                    frames (paths or frame store keys), shard size, model config
+        leases/shard_000003.lease   claimed shard, kept alive by the owner's heartbeat
+        results/shard_000000.json   finished shard (bubble tables per frame), written atomically
+        bubbles.csv, summary.json   written by merge
+
+Shards are claimed by creating their lease file with O_EXCL. A lease whose heartbeat (mtime) is
+older than the lease timeout is taken over by renaming it away first, which only one worker can
+do. Results are written to a temporary file and moved into place with os.replace, so a shard is
+either done or not, and restarted workers skip all shards that have a result.
+
+    python utils_JobRunner.py init job --frames 'data/frames/*.png' --models Models/ --shard-size 500
+    python utils_JobRunner.py work job            # on every node, as often as wanted
+    python utils_JobRunner.py merge job
+
+The per frame work is pluggable: --processor module:factory names a function that gets the job
+config and returns process_frame(X, timestep) -> list of bubble rows (utils_Service.BUBBLE_FIELDS).
+X is the percentile normalized frame of utils_FrameLoader.FrameSource, which decodes the next frames
+of the shard while the current one is processed. The default loads StarDist and the RDC net once per
+worker (utils_Service.InferenceService).
+"""
+
+import os
+import csv
+import json
+import glob
+import time
+import uuid
+import socket
+import argparse
+import importlib
+import threading
+import multiprocessing
+import numpy as np
+
+JOB_FILE = 'job.json'
+DEFAULT_SHARD_SIZE = 500
+LEASE_TIMEOUT = 600.0
+HEARTBEAT = 30.0
+LEASE_RETRY = 1.0
+
+
+def _jsonDefault(o):
+    if hasattr(o, 'tolist'):
+        return o.tolist()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def writeAtomic(path, payload):
+    """ Writes payload as JSON to path via a temporary file and os.replace. """
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(payload, f, default=_jsonDefault)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def initJob(job_dir, frames, shard_size=DEFAULT_SHARD_SIZE, store=None, dataset='raw', config=None):
+    """ Creates the job directory for a list of frame paths (or keys of store[dataset]).
+
+    config is stored in job.json and passed to the processor factory (models, metric, ...).
+    Returns the Job.
+    """
+    if os.path.exists(os.path.join(job_dir, JOB_FILE)):
+        raise FileExistsError(f"Job already initialized in {job_dir}")
+    frames = [f if store is not None else os.path.abspath(f) for f in frames]
+    if len(frames) == 0:
+        raise ValueError("No frames for the job")
+    for sub in ('leases', 'results'):
+        os.makedirs(os.path.join(job_dir, sub), exist_ok=True)
+    writeAtomic(os.path.join(job_dir, JOB_FILE), {
+        'version': 1, 'frames': frames, 'shard_size': int(shard_size), 'created': time.time(),
+        'store': None if store is None else os.path.abspath(store), 'dataset': dataset, 'config': config or {}})
+    return Job(job_dir)
+
+
+class Job:
+    """ Read-only view of a job directory (see initJob). """
+
+    def __init__(self, job_dir):
+        self.path = job_dir
+        with open(os.path.join(job_dir, JOB_FILE)) as f:
+            self.meta = json.load(f)
+        self.frames = self.meta['frames']
+        self.shard_size = self.meta['shard_size']
+        self.config = self.meta['config']
+        self._dataset = None
+
+    @property
+    def n_shards(self):
+        return (len(self.frames) + self.shard_size - 1) // self.shard_size
+
+    def shardRange(self, k):
+        """ Global frame indices (= timesteps) of shard k. """
+        return range(k * self.shard_size, min((k + 1) * self.shard_size, len(self.frames)))
+
+    def leasePath(self, k):
+        return os.path.join(self.path, 'leases', f"shard_{k:06d}.lease")
+
+    def resultPath(self, k):
+        return os.path.join(self.path, 'results', f"shard_{k:06d}.json")
+
+    def isDone(self, k):
+        return os.path.exists(self.resultPath(k))
+
+    def frameLoader(self):
+        """ Function job frame (path or store key) -> frame. """
+        if self.meta['store'] is None:
+            from utils_FrameLoader import load_frame
+            return load_frame
+        if self._dataset is None:
+            from utils_FrameStore import FrameStore
+            self._dataset = FrameStore(self.meta['store'])[self.meta['dataset']]
+        return self._dataset.read_frame
+
+    def loadFrame(self, i):
+        return self.frameLoader()(self.frames[i])
+
+    def status(self):
+        """ Counts of done, leased (alive or stale) and open shards. """
+        done = leased = 0
+        for k in range(self.n_shards):
+            if self.isDone(k):
+                done += 1
+            elif os.path.exists(self.leasePath(k)):
+                leased += 1
+        return {'shards': self.n_shards, 'done': done, 'leased': leased, 'open': self.n_shards - done - leased,
+                'frames': len(self.frames)}
+
+
+class Lease:
+    """ Claim on one shard, renewed by a heartbeat thread that touches the lease file.
+
+    Use Lease.acquire, which returns None if the shard is held by a live worker.
+    """
+
+    def __init__(self, path, worker, token, heartbeat=HEARTBEAT):
+        self.path = path
+        self.worker = worker
+        self.token = token
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, args=(heartbeat,), daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _create(path, worker):
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': worker, 'token': token, 'claimed': time.time()}, f)
+        return token
+
+    @staticmethod
+    def _token(path):
+        try:
+            with open(path) as f:
+                return json.load(f).get('token')
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def acquire(cls, path, worker, timeout=LEASE_TIMEOUT, heartbeat=HEARTBEAT):
+        token = cls._create(path, worker)
+        if token is None:
+            try:
+                age = time.time() - os.stat(path).st_mtime
+            except FileNotFoundError:
+                age = np.inf
+            if age < timeout:
+                return None
+            # Stale lease: move it away (only one worker wins the rename), then check that the
+            # moved file is still the stale one: same token (not replaced by a new claim) and
+            # no heartbeat (utime) between the check above and the rename
+            stale_token = cls._token(path)
+            grave = f"{path}.{uuid.uuid4().hex}.stale"
+            try:
+                os.rename(path, grave)
+            except FileNotFoundError:
+                return None
+            if cls._token(grave) != stale_token or time.time() - os.stat(grave).st_mtime < timeout:
+                try:
+                    os.link(grave, path)
+                except FileExistsError:
+                    pass
+                os.remove(grave)
+                return None
+            os.remove(grave)
+            token = cls._create(path, worker)
+            if token is None:
+                return None
+        return cls(path, worker, token, heartbeat)
+
+    def _beat(self, heartbeat):
+        while not self._stop.wait(heartbeat):
+            if not self.valid():
+                self.lost = True
+                return
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                # Moved away by a staleness check right now, renewed on the next beat
+                pass
+
+    def valid(self, retry=LEASE_RETRY):
+        """ True while the lease file is still the one this worker created.
+
+        A worker checking for staleness moves a live lease away and links it back, so a missing or
+        foreign lease is read again after retry seconds before it counts as lost.
+        """
+        if self.lost:
+            return False
+        if self._token(self.path) == self.token:
+            return True
+        time.sleep(retry)
+        return self._token(self.path) == self.token
+
+    def release(self):
+        self._stop.set()
+        self._thread.join()
+        if self._token(self.path) == self.token:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def serviceProcessor(config):
+    """ Default processor factory: StarDist + RDC models of utils_Service.InferenceService. """
+    from utils_Service import InferenceService
+    service = InferenceService(config.get('models', 'Models'), config.get('sd_name', 'data_mix_64_400'),
+                               config.get('rdc', 'RDC/rdc_model_mm.h5'), config.get('metric', 5.2E-2),
+                               config.get('gpu', False))
+    useRDC = config.get('useRDC', True)
+
+    def process_frame(X, timestep):
+        return service.predict(X, useRDC=useRDC, timestep=timestep, normalized=True)['bubbles']
+
+    return process_frame
+
+
+def resolveProcessor(name):
+    """ Processor factory from a 'module:function' string, None for serviceProcessor. """
+    if not name:
+        return serviceProcessor
+    module, _, func = name.partition(':')
+    return getattr(importlib.import_module(module), func)
+
+
+def processShard(job, k, process_frame, num_workers=2, prefetch=4):
+    """ Bubble rows of every frame of shard k, frames are decoded and normalized ahead by a
+    FrameSource while process_frame runs.
+    """
+    from utils_FrameLoader import FrameSource
+    indices = job.shardRange(k)
+    source = FrameSource([job.frames[i] for i in indices], loader=job.frameLoader(), num_workers=num_workers,
+                         prefetch=prefetch)
+    frames = []
+    for i, (frame, X) in zip(indices, source):
+        frames.append({'index': i, 'frame': frame, 'bubbles': process_frame(X, i)})
+    return {'shard': k, 'frames': frames}
+
+
+def runWorker(job_dir, processor=None, worker_id=None, lease_timeout=LEASE_TIMEOUT, heartbeat=HEARTBEAT,
+              max_shards=None, verbose=True):
+    """ Claims and processes open shards until none is left, returns the number of shards done.
+
+    The processor (factory, see resolveProcessor) is only called once a first shard is claimed,
+    so idle workers do not load models.
+    """
+    job = Job(job_dir)
+    worker = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    factory = processor if callable(processor) else resolveProcessor(processor)
+    process_frame = None
+    n_done = 0
+    # Workers start at different shards to reduce collisions on the lease files
+    start = int(uuid.uuid4().int % max(job.n_shards, 1))
+    for k in (np.arange(job.n_shards) + start) % max(job.n_shards, 1):
+        k = int(k)
+        if max_shards is not None and n_done >= max_shards:
+            break
+        if job.isDone(k):
+            continue
+        lease = Lease.acquire(job.leasePath(k), worker, lease_timeout, heartbeat)
+        if lease is None:
+            continue
+        try:
+            # Another worker may have finished it between the check and the claim
+            if job.isDone(k):
+                continue
+            if process_frame is None:
+                process_frame = factory(job.config)
+            t = time.perf_counter()
+            result = processShard(job, k, process_frame)
+            result.update(worker=worker, seconds=time.perf_counter() - t)
+            # The shard belongs to another worker once the lease is lost, only the owner publishes
+            if not lease.valid():
+                if verbose:
+                    print(f"[{worker}] shard {k}: lease was lost, result discarded")
+                continue
+            writeAtomic(job.resultPath(k), result)
+            n_done += 1
+            if verbose:
+                print(f"[{worker}] shard {k} done ({len(result['frames'])} frames, {result['seconds']:.1f} s)")
+        finally:
+            lease.release()
+    return n_done
+
+
+def _workerProcess(job_dir, processor, lease_timeout, heartbeat, index):
+    return runWorker(job_dir, processor, f"{socket.gethostname()}-{os.getpid()}-{index}", lease_timeout, heartbeat)
+
+
+def runLocal(job_dir, n_processes, processor=None, lease_timeout=LEASE_TIMEOUT, heartbeat=HEARTBEAT):
+    """ Runs n_processes workers on this node (e.g. to test the job locally). """
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(n_processes) as pool:
+        return sum(pool.starmap(_workerProcess, [(job_dir, processor, lease_timeout, heartbeat, i)
+                                                 for i in range(n_processes)]))
+
+
+def mergeResults(job_dir, allow_partial=False, window=100):
+    """ Combines the shard results into bubbles.csv and summary.json (utils_Statistics) in the
+    job directory, frames in job order. Returns the SizeDistribution.
+    """
+    from utils_Service import bubblesFromTable
+    from utils_Statistics import SizeDistribution
+    job = Job(job_dir)
+    missing = [k for k in range(job.n_shards) if not job.isDone(k)]
+    if missing and not allow_partial:
+        raise RuntimeError(f"{len(missing)} of {job.n_shards} shards are not done (first: {missing[0]})")
+    stats = SizeDistribution(window=window)
+    tmp = os.path.join(job_dir, f"bubbles.csv.{uuid.uuid4().hex}.tmp")
+    with open(tmp, 'w', newline='') as f:
+        wr = csv.writer(f)
+        wr.writerow(['frame', 'x', 'y', 'Diameter', 'Major', 'Minor', 'Volume', 'Timestep', 'ID'])
+        for k in range(job.n_shards):
+            if k in missing:
+                continue
+            with open(job.resultPath(k)) as g:
+                result = json.load(g)
+            for entry in result['frames']:
+                bubbles = bubblesFromTable(entry['bubbles'])
+                stats.update(bubbles, entry['index'])
+                for bub in bubbles:
+                    wr.writerow([entry['frame'], bub.Position[1], bub.Position[0], bub.Diameter, bub.Major,
+                                 bub.Minor, bub.Volume, bub.Timestep, bub.ID])
+    os.replace(tmp, os.path.join(job_dir, 'bubbles.csv'))
+    summary = stats.summary()
+    summary['missing_shards'] = missing
+    writeAtomic(os.path.join(job_dir, 'summary.json'), summary)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sharded, resumable bubble reconstruction jobs')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('init', help='create a job directory')
+    p.add_argument('job')
+    p.add_argument('--frames', nargs='+', help='frame files or glob patterns')
+    p.add_argument('--store', help='frame store (utils_FrameStore) instead of --frames')
+    p.add_argument('--dataset', default='raw')
+    p.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    p.add_argument('--models', default=os.path.join(os.path.abspath(''), 'Models'))
+    p.add_argument('--sd-name', default='data_mix_64_400')
+    p.add_argument('--rdc', default='RDC/rdc_model_mm.h5')
+    p.add_argument('--metric', type=float, default=5.2E-2)
+    p.add_argument('--no-rdc', action='store_true', help='fit ellipses instead of the RDC reconstruction')
+    p = sub.add_parser('work', help='process open shards')
+    p.add_argument('job')
+    p.add_argument('--processor', help='module:factory returning process_frame(X, timestep)')
+    p.add_argument('--processes', type=int, default=1, help='local worker processes')
+    p.add_argument('--worker-id')
+    p.add_argument('--lease-timeout', type=float, default=LEASE_TIMEOUT)
+    p.add_argument('--heartbeat', type=float, default=HEARTBEAT)
+    p.add_argument('--max-shards', type=int)
+    p = sub.add_parser('merge', help='combine the shard results')
+    p.add_argument('job')
+    p.add_argument('--partial', action='store_true', help='merge even if shards are missing')
+    p = sub.add_parser('status')
+    p.add_argument('job')
+    args = parser.parse_args()
+
+    if args.command == 'init':
+        if args.store:
+            from utils_FrameStore import FrameStore
+            frames = FrameStore(args.store)[args.dataset].keys()
+        else:
+            frames = sorted(p for pattern in args.frames or [] for p in (glob.glob(pattern) or [pattern]))
+        config = {'models': os.path.abspath(args.models), 'sd_name': args.sd_name, 'rdc': args.rdc,
+                  'metric': args.metric, 'useRDC': not args.no_rdc}
+        job = initJob(args.job, frames, args.shard_size, args.store, args.dataset, config)
+        print(f"Job with {len(job.frames)} frames in {job.n_shards} shards")
+    elif args.command == 'work':
+        if args.processes > 1:
+            n = runLocal(args.job, args.processes, args.processor, args.lease_timeout, args.heartbeat)
+        else:
+            n = runWorker(args.job, args.processor, args.worker_id, args.lease_timeout, args.heartbeat,
+                          args.max_shards)
+        print(f"{n} shards processed, status: {Job(args.job).status()}")
+    elif args.command == 'merge':
+        stats = mergeResults(args.job, args.partial)
+        print(f"Merged {stats.frames} frames with {stats.bubbles} bubbles")
+    else:
+        print(json.dumps(Job(args.job).status()))
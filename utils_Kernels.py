@@ -0,0 +1,389 @@
+"""
+Hot loops of the reconstruction (ray stretching, touching detection, max distance axis,
+controlled dilation) as numba kernels with pure NumPy fallbacks.
+
+The numba versions are compiled on first use with cache=True (the machine code is stored in
+__pycache__, so later worker starts skip the JIT) and nogil=True, so they can run in parallel
+from threads. Without numba, or with BUBBLE_KERNELS=numpy, the NumPy versions are used.
+Both give identical results; run "python utils_Kernels.py" to check parity.
+"""
+
+import os
+import threading
+import warnings
+import numpy as np
+
+_lock = threading.Lock()
+_compiled = {}
+
+
+def _stretch_rays(img, label, cy, cx, sin_phi, cos_phi, oy, ox, H, W):
+    # Same stepping as RDObj.generateRD_manual: walk each ray in unit steps starting at 5 and
+    # keep the last position before the ray hits the frame border or another label.
+    # img may be a crop at offset (oy, ox) of a frame of shape (H, W), positions outside the crop
+    # count as other label
+    h, w = img.shape
+    n = sin_phi.shape[0]
+    points = np.zeros((n, 2))
+    for k in range(n):
+        stretch = 5
+        while True:
+            y = cy + sin_phi[k] * stretch
+            x = cx + cos_phi[k] * stretch
+            if y < 0:
+                y = 0.0
+            if x < 0:
+                x = 0.0
+            if y >= H - 1:
+                y = H - 1.0
+            if x >= W - 1:
+                x = W - 1.0
+            iy = int(y) - oy
+            ix = int(x) - ox
+            if iy + oy == 0 or ix + ox == 0 or iy + oy == H - 1 or ix + ox == W - 1 or \
+                    iy < 0 or ix < 0 or iy >= h or ix >= w or img[iy, ix] != label:
+                points[k, 0] = cy + sin_phi[k] * (stretch - 1)
+                points[k, 1] = cx + cos_phi[k] * (stretch - 1)
+                break
+            stretch += 1
+    return points
+
+
+def _stretch_rays_np(img, label, cy, cx, sin_phi, cos_phi, oy, ox, H, W):
+    h, w = img.shape
+    n = sin_phi.shape[0]
+    points = np.zeros((n, 2))
+    done = np.zeros(n, dtype=bool)
+    stretch = 5
+    while not done.all():
+        iy = np.clip(cy + sin_phi * stretch, 0, H - 1).astype(int)
+        ix = np.clip(cx + cos_phi * stretch, 0, W - 1).astype(int)
+        ly, lx = iy - oy, ix - ox
+        inside = (ly >= 0) & (lx >= 0) & (ly < h) & (lx < w)
+        other = np.ones(n, dtype=bool)
+        other[inside] = img[ly[inside], lx[inside]] != label
+        touch = (iy == 0) | (ix == 0) | (iy == H - 1) | (ix == W - 1) | other
+        new = touch & ~done
+        points[new, 0] = cy + sin_phi[new] * (stretch - 1)
+        points[new, 1] = cx + cos_phi[new] * (stretch - 1)
+        done |= new
+        stretch += 1
+    return points
+
+
+def _touching(img, points, oy, ox, H, W):
+    # Same rule as RDObj.getTouchingCandidates: outside the frame, on the top/left border or
+    # all 9 neighbors (zero padded) belong to some label. Neighbors outside the crop count as 0
+    h, w = img.shape
+    n = points.shape[0]
+    flags = np.zeros(n, dtype=np.int64)
+    for k in range(n):
+        i = points[k, 0]
+        j = points[k, 1]
+        if i < 0 or j < 0 or i >= H or j >= W or i == 0 or j == 0:
+            flags[k] = 1
+            continue
+        surrounded = True
+        for di in range(-1, 2):
+            for dj in range(-1, 2):
+                ii = i + di - oy
+                jj = j + dj - ox
+                if ii < 0 or jj < 0 or ii >= h or jj >= w or i + di >= H or j + dj >= W or img[ii, jj] == 0:
+                    surrounded = False
+        if surrounded:
+            flags[k] = 1
+    return flags
+
+
+def _touching_np(img, points, oy, ox, H, W):
+    h, w = img.shape
+    i = points[:, 0]
+    j = points[:, 1]
+    inside = (i >= 0) & (j >= 0) & (i < H) & (j < W)
+    flags = ~inside | (i == 0) | (j == 0)
+    surrounded = inside.copy()
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            ii, jj = i + di - oy, j + dj - ox
+            valid = inside & (ii >= 0) & (jj >= 0) & (ii < h) & (jj < w) & (i + di < H) & (j + dj < W)
+            values = np.zeros(len(points), dtype=img.dtype)
+            values[valid] = img[ii[valid], jj[valid]]
+            surrounded &= values != 0
+    return (flags | surrounded).astype(np.int64)
+
+
+def _max_dist_axis(points):
+    # First pair (in i, j loop order) with the strictly largest distance, as getMaxDistAxis
+    best = 0.0
+    bi = -1
+    bj = -1
+    n = points.shape[0]
+    for i in range(n):
+        for j in range(n):
+            dist = np.sqrt((points[i, 0] - points[j, 0])**2 + (points[i, 1] - points[j, 1])**2)
+            if dist > best:
+                best = dist
+                bi = i
+                bj = j
+    return bi, bj
+
+
+def _max_dist_axis_np(points):
+    n = len(points)
+    if n == 0:
+        return -1, -1
+    dist = np.sqrt((points[:, 0:1] - points[:, 0])**2 + (points[:, 1:2] - points[:, 1])**2)
+    k = np.argmax(dist)
+    if dist.flat[k] <= 0:
+        return -1, -1
+    return k // n, k % n
+
+
+def _controlled_dilation(labels, imgMask, imgIntersec):
+    # Grows every label into free mask pixels (label 0, mask > 0, no intersection) by one
+    # pixel, later pixels in row-major order overwrite earlier ones as in the original loop
+    H, W = labels.shape
+    labels_copy = labels.copy()
+    dilated = False
+    for i in range(H):
+        for j in range(W):
+            if labels[i, j] > 0:
+                for e in range(3):
+                    for ee in range(3):
+                        ni = i + e - 1
+                        nj = j + ee - 1
+                        if ni >= 0 and nj >= 0 and ni < H and nj < W:
+                            if labels[ni, nj] == 0 and imgMask[ni, nj] > 0 and imgIntersec[ni, nj] == 0:
+                                labels_copy[ni, nj] = labels[i, j]
+                                dilated = True
+    return labels_copy, dilated
+
+
+def _controlled_dilation_np(labels, imgMask, imgIntersec):
+    H, W = labels.shape
+    labels_copy = labels.copy()
+    free = (labels == 0) & (imgMask > 0) & (imgIntersec == 0)
+    dilated = False
+    # Offsets target - source, ordered so that the sources are visited in row-major order
+    for dy, dx in ((1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1)):
+        t = (slice(max(dy, 0), H + min(dy, 0)), slice(max(dx, 0), W + min(dx, 0)))
+        s = (slice(max(-dy, 0), H + min(-dy, 0)), slice(max(-dx, 0), W + min(-dx, 0)))
+        src = labels[s]
+        sel = free[t] & (src > 0)
+        if sel.any():
+            labels_copy[t][sel] = src[sel]
+            dilated = True
+    return labels_copy, dilated
+
+
+# Neighbor offsets (source - target) in descending row-major order of the source, the first
+# labeled neighbor found is the one the row-major loop of _controlled_dilation writes last
+_SOURCE_ORDER = np.array([(1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1)], dtype=np.int64)
+
+
+def _frontier_dilation(labels, imgMask, imgIntersec, ys, xs, order):
+    # One controlled dilation step in place that only visits the 3x3 neighborhoods of the pixels
+    # (ys, xs) filled in the step before, the only places where free pixels can be filled now.
+    # Returns the filled pixels
+    H, W = labels.shape
+    n = ys.shape[0]
+    ty = np.empty(8 * n, dtype=np.int64)
+    tx = np.empty(8 * n, dtype=np.int64)
+    tv = np.empty(8 * n, dtype=labels.dtype)
+    m = 0
+    for k in range(n):
+        for d in range(8):
+            i = ys[k] - order[d, 0]
+            j = xs[k] - order[d, 1]
+            if i < 0 or j < 0 or i >= H or j >= W:
+                continue
+            if labels[i, j] != 0 or imgMask[i, j] <= 0 or imgIntersec[i, j] != 0:
+                continue
+            for e in range(8):
+                si = i + order[e, 0]
+                sj = j + order[e, 1]
+                if si >= 0 and sj >= 0 and si < H and sj < W and labels[si, sj] > 0:
+                    ty[m] = i
+                    tx[m] = j
+                    tv[m] = labels[si, sj]
+                    m += 1
+                    break
+    # Written after all values are known, every step reads the previous state only
+    keep = np.zeros(m, dtype=np.bool_)
+    for k in range(m):
+        if labels[ty[k], tx[k]] == 0:
+            labels[ty[k], tx[k]] = tv[k]
+            keep[k] = True
+    return ty[:m][keep], tx[:m][keep]
+
+
+def _frontier_dilation_np(labels, imgMask, imgIntersec, ys, xs, order):
+    H, W = labels.shape
+    ty = (ys[:, np.newaxis] - order[:, 0]).ravel()
+    tx = (xs[:, np.newaxis] - order[:, 1]).ravel()
+    inside = (ty >= 0) & (tx >= 0) & (ty < H) & (tx < W)
+    keys = np.unique(ty[inside] * W + tx[inside])
+    ty, tx = keys // W, keys % W
+    free = (labels[ty, tx] == 0) & (imgMask[ty, tx] > 0) & (imgIntersec[ty, tx] == 0)
+    ty, tx = ty[free], tx[free]
+    values = np.zeros(len(ty), dtype=labels.dtype)
+    found = np.zeros(len(ty), dtype=bool)
+    for dy, dx in order:
+        sy, sx = ty + dy, tx + dx
+        valid = ~found & (sy >= 0) & (sx >= 0) & (sy < H) & (sx < W)
+        src = np.zeros(len(ty), dtype=labels.dtype)
+        src[valid] = labels[sy[valid], sx[valid]]
+        new = valid & (src > 0)
+        values[new] = src[new]
+        found |= new
+    ty, tx = ty[found], tx[found]
+    labels[ty, tx] = values[found]
+    return ty, tx
+
+
+_KERNELS = {
+    'stretch_rays': (_stretch_rays, _stretch_rays_np),
+    'touching': (_touching, _touching_np),
+    'max_dist_axis': (_max_dist_axis, _max_dist_axis_np),
+    'controlled_dilation': (_controlled_dilation, _controlled_dilation_np),
+    'frontier_dilation': (_frontier_dilation, _frontier_dilation_np),
+}
+
+
+def backend():
+    """ 'numba' if the compiled kernels are available, else 'numpy'. """
+    if os.environ.get('BUBBLE_KERNELS', '').lower() == 'numpy':
+        return 'numpy'
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return 'numpy'
+    return 'numba'
+
+
+def _kernel(name):
+    fn = _compiled.get(name)
+    if fn is None:
+        with _lock:
+            fn = _compiled.get(name)
+            if fn is None:
+                py_fn, np_fn = _KERNELS[name]
+                fn = np_fn
+                if backend() == 'numba':
+                    import numba
+                    fn = numba.njit(cache=True, nogil=True)(py_fn)
+                _compiled[name] = fn
+    return fn
+
+
+def _call(name, *args):
+    fn = _kernel(name)
+    try:
+        return fn(*args)
+    except Exception as e:
+        if fn is _KERNELS[name][1] or type(e).__module__.split('.')[0] != 'numba':
+            raise
+        warnings.warn(f"numba kernel {name} failed ({e}), using the NumPy version")
+        _compiled[name] = _KERNELS[name][1]
+        return _KERNELS[name][1](*args)
+
+
+def stretch_rays(img, label, center, sin_phi, cos_phi, offset=(0, 0), frame_shape=None):
+    """ Float (n_rays, 2) ray end points (y,x) of label in img for the given ray directions.
+
+    img may be a crop at offset (y,x) of a frame of shape frame_shape (see utils_ROI), center and
+    end points are in frame coordinates.
+    """
+    H, W = img.shape if frame_shape is None else frame_shape
+    return _call('stretch_rays', np.ascontiguousarray(img), img.dtype.type(label), float(center[0]), float(center[1]),
+                 np.ascontiguousarray(sin_phi, dtype=np.float64), np.ascontiguousarray(cos_phi, dtype=np.float64),
+                 int(offset[0]), int(offset[1]), int(H), int(W))
+
+
+def touching_candidates(img, points, offset=(0, 0), frame_shape=None):
+    """ 1 for every integer end point (y,x,...) touching another instance or the frame border. """
+    H, W = img.shape if frame_shape is None else frame_shape
+    return _call('touching', np.ascontiguousarray(img), np.ascontiguousarray(points[:, :2], dtype=np.int64),
+                 int(offset[0]), int(offset[1]), int(H), int(W))
+
+
+def max_dist_axis(points):
+    """ Indices (i, j) of the two points with the largest distance, (-1, -1) if all coincide. """
+    i, j = _call('max_dist_axis', np.ascontiguousarray(np.asarray(points)[:, :2], dtype=np.float64))
+    return int(i), int(j)
+
+
+def controlled_dilation(labels, imgMask, imgIntersec):
+    """ One dilation step of all labels into the mask, returns (labels_copy, dilated). """
+    return _call('controlled_dilation', np.ascontiguousarray(labels), np.ascontiguousarray(imgMask),
+                 np.ascontiguousarray(imgIntersec))
+
+
+def frontier_dilation(labels, imgMask, imgIntersec, ys, xs):
+    """ controlled_dilation step on labels in place (C-contiguous) for the pixels (ys, xs) filled
+    in the previous step, returns the pixels filled now.
+    """
+    return _call('frontier_dilation', labels, np.ascontiguousarray(imgMask), np.ascontiguousarray(imgIntersec),
+                 np.ascontiguousarray(ys, dtype=np.int64), np.ascontiguousarray(xs, dtype=np.int64), _SOURCE_ORDER)
+
+
+def checkParity(num_trials=20, seed=0):
+    """ Compares the numba kernels against the NumPy fallbacks (and the frontier dilation against
+    the full controlled dilation) on random label images, raises AssertionError on a mismatch.
+    Without numba only the NumPy kernels are checked.
+    """
+    assert_equal = np.testing.assert_array_equal
+    use_numba = backend() == 'numba'
+    rng = np.random.default_rng(seed)
+    for trial in range(num_trials):
+        H, W = (int(v) for v in rng.integers(20, 120, size=2))
+        labels = np.zeros((H, W), dtype=np.int32)
+        yy, xx = np.mgrid[:H, :W]
+        for lbl in range(1, rng.integers(2, 6)):
+            cy, cx, r = rng.uniform(0, H), rng.uniform(0, W), rng.uniform(4, 25)
+            labels[(yy - cy)**2 + (xx - cx)**2 < r**2] = lbl
+        mask = (rng.random((H, W)) > 0.2).astype(np.uint8)
+        inter = (rng.random((H, W)) > 0.95).astype(np.uint8)
+        phis = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+        for lbl in np.unique(labels)[1:]:
+            center = np.argwhere(labels == lbl).mean(axis=0)
+            ys, xs = np.nonzero(labels == lbl)
+            oy, ox = max(ys.min() - 6, 0), max(xs.min() - 6, 0)
+            crop = np.ascontiguousarray(labels[oy:ys.max() + 7, ox:xs.max() + 7])
+            points, flags = [], []
+            for img, off in ((labels, (0, 0)), (crop, (oy, ox))):
+                args = (img, labels.dtype.type(lbl), center[0], center[1], np.sin(phis), np.cos(phis)) + off + (H, W)
+                p_np = _stretch_rays_np(*args)
+                pts = p_np.astype(np.int64)
+                t_np = _touching_np(img, pts, *off, H, W)
+                if use_numba:
+                    assert_equal(_kernel('stretch_rays')(*args), p_np, err_msg=f"stretch_rays, trial {trial}")
+                    assert_equal(_kernel('touching')(img, pts, *off, H, W), t_np, err_msg=f"touching, trial {trial}")
+                points.append(p_np)
+                flags.append(t_np)
+            assert_equal(points[1], points[0], err_msg=f"stretch_rays crop vs frame, trial {trial}")
+            assert_equal(flags[1], flags[0], err_msg=f"touching crop vs frame, trial {trial}")
+            if use_numba:
+                assert_equal(_kernel('max_dist_axis')(points[0]), _max_dist_axis_np(points[0]),
+                             err_msg=f"max_dist_axis, trial {trial}")
+        d_np = _controlled_dilation_np(labels, mask, inter)
+        if use_numba:
+            d_nb = _kernel('controlled_dilation')(labels, mask, inter)
+            assert_equal(d_nb[0], d_np[0], err_msg=f"controlled_dilation, trial {trial}")
+            assert d_nb[1] == d_np[1], f"controlled_dilation flag, trial {trial}"
+        ys, xs = np.nonzero(d_np[0] != labels)
+        f_np = d_np[0].copy()
+        n_np = _frontier_dilation_np(f_np, mask, inter, ys, xs, _SOURCE_ORDER)
+        assert_equal(f_np, _controlled_dilation_np(d_np[0], mask, inter)[0],
+                     err_msg=f"frontier vs controlled dilation, trial {trial}")
+        if use_numba:
+            f_nb = d_np[0].copy()
+            n_nb = _kernel('frontier_dilation')(f_nb, mask, inter, ys, xs, _SOURCE_ORDER)
+            assert_equal(f_nb, f_np, err_msg=f"frontier_dilation, trial {trial}")
+            assert set(zip(*n_nb)) == set(zip(*n_np)), f"frontier_dilation pixels, trial {trial}"
+    return True
+
+
+if __name__ == '__main__':
+    checkParity()
+    print("Kernel parity: OK" + ("" if backend() == 'numba' else " (numba not available, NumPy kernels only)"))
@@ -0,0 +1,229 @@
+import math
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.patches import Ellipse
+from matplotlib.path import Path
+from matplotlib.widgets import Button
+
+
+def plotVisualItems(ax, VisualItems):
+    """ Draws all visual items of HiddenReco at once (non interactive). """
+    for item in VisualItems:
+        if item['type'] == 'rdc':
+            points = item['points']
+            color = item['color']
+            a,b = list(points[:,1]),list(points[:,0])
+            a += a[:1]
+            b += b[:1]
+            ax.plot(a,b, '-', alpha=1, zorder=1, color=color, linewidth=1.5)
+
+        elif item['type'] == 'ellipse':
+            params = item['params']
+            color = item['color']
+            y0, x0, a, b, phi = params
+            ellipse = Ellipse((y0, x0), 2*a, 2*b, angle=math.degrees(phi), alpha=0.25, color=color)
+            ax.add_artist(ellipse)
+
+class BubbleStepper:
+    def __init__(self, ax, visual_items, background_img=None):
+        self.ax = ax
+        self.visual_items = visual_items
+        self.background_img = background_img
+        self.current_idx = -1
+        self.artists = [] 
+        self.detail_fig = None
+        
+        plt.subplots_adjust(bottom=0.2)
+        ax_prev = plt.axes([0.7, 0.05, 0.1, 0.075])
+        ax_next = plt.axes([0.81, 0.05, 0.1, 0.075])
+        self.bnext = Button(ax_next, 'Next')
+        self.bprev = Button(ax_prev, 'Prev')
+        self.bnext.on_clicked(self.next)
+        self.bprev.on_clicked(self.prev)
+        
+        self.ax.figure.canvas.mpl_connect('key_press_event', self.on_key)
+        self.ax.figure.canvas.mpl_connect('button_press_event', self.on_click)
+        print("Interactive Mode: Press Right/Next to draw bubble, Left/Prev to undo. Click on bubble to view detail with rays.")
+        plt.show(block=True)
+
+    def next(self, event=None):
+        if self.current_idx < len(self.visual_items) - 1:
+            self.current_idx += 1
+            item = self.visual_items[self.current_idx]
+            self.draw_item(item)
+            self.ax.figure.canvas.draw_idle()
+
+    def prev(self, event=None):
+        if self.current_idx >= 0:
+            if self.artists:
+                last_artists = self.artists.pop()
+                for art in last_artists:
+                    art.remove()
+                self.current_idx -= 1
+                self.ax.figure.canvas.draw_idle()
+
+    def draw_item(self, item, draw_rays=False):
+        new_artists = []
+        if item['type'] == 'rdc':
+            points = item['points']
+            color = item['color']
+            a,b = list(points[:,1]),list(points[:,0])
+            a += a[:1]
+            b += b[:1]
+            lines = self.ax.plot(a,b, '-', alpha=1, zorder=1, color=color, linewidth=1.5)
+            new_artists.extend(lines)
+            
+            # Draw rays if requested and center is available
+            if draw_rays and 'center' in item:
+                center = item['center']
+                num_rays = len(points)
+                dist_lines = np.empty((num_rays, 2, 2))
+                dist_lines[:, 0, 0] = points[:, 1]
+                dist_lines[:, 0, 1] = points[:, 0]
+                dist_lines[:, 1, 0] = center[1]
+                dist_lines[:, 1, 1] = center[0]
+                lc = LineCollection(dist_lines, colors=color, linewidths=0.6, alpha=0.7)
+                self.ax.add_collection(lc)
+                new_artists.append(lc)
+                
+        elif item['type'] == 'ellipse':
+            params = item['params']
+            color = item['color']
+            y0, x0, a, b, phi = params
+            ellipse = Ellipse((y0, x0), 2*a, 2*b, angle=math.degrees(phi), alpha=0.25, color=color)
+            self.ax.add_artist(ellipse)
+            new_artists.append(ellipse)
+        self.artists.append(new_artists)
+    
+    def on_click(self, event):
+        """Handle click event to show clicked bubble with rays in a new figure"""
+        if event.inaxes != self.ax:
+            return
+        
+        click_x, click_y = event.xdata, event.ydata
+        
+        # Find which bubble was clicked (check only drawn bubbles)
+        for idx in range(self.current_idx + 1):
+            item = self.visual_items[idx]
+            if item['type'] == 'rdc':
+                points = item['points']
+                center = item.get('center', None)
+                if center is None:
+                    continue
+                
+                # Check if click is inside the bubble polygon
+                polygon_path = Path(np.column_stack([points[:, 1], points[:, 0]]))
+                if polygon_path.contains_point((click_x, click_y)):
+                    self.show_bubble_detail(item, idx)
+                    return
+            elif item['type'] == 'ellipse':
+                params = item['params']
+                y0, x0, a, b, phi = params
+                # Simple distance check for ellipse
+                dx = click_x - y0
+                dy = click_y - x0
+                # Rotate point to ellipse coordinate system
+                cos_phi = np.cos(-phi)
+                sin_phi = np.sin(-phi)
+                dx_rot = dx * cos_phi - dy * sin_phi
+                dy_rot = dx * sin_phi + dy * cos_phi
+                # Check if inside ellipse
+                if (dx_rot**2 / a**2 + dy_rot**2 / b**2) <= 1:
+                    self.show_bubble_detail(item, idx)
+                    return
+    
+    def show_bubble_detail(self, item, idx):
+        """Show a new figure with only the clicked bubble and its rays"""
+        # Close previous detail figure if it exists
+        if self.detail_fig is not None and plt.fignum_exists(self.detail_fig.number):
+            plt.close(self.detail_fig)
+            
+        fig, ax = plt.subplots(figsize=(8, 8))
+        self.detail_fig = fig
+        
+        if self.background_img is not None:
+            ax.imshow(self.background_img, cmap='gray')
+        
+        if item['type'] == 'rdc':
+            points = item['points']
+            color = item['color']
+            center = item.get('center', None)
+            dists = item.get('dists', None)
+            pixel_count = item.get('pixel_count', 'N/A')
+            
+            # Calculate area (approximate via polygon)
+            # from skimage.measure import moments_polygon # REMOVED: Causing ImportError and not needed (using Shoelace formula below)
+            if len(points) > 2:
+                # points are (y, x)
+                poly_area = 0.5 * np.abs(np.dot(points[:, 1], np.roll(points[:, 0], 1)) - np.dot(points[:, 0], np.roll(points[:, 1], 1)))
+            else:
+                poly_area = 0
+            
+            # Draw rays first (behind the polygon)
+            if center is not None:
+                num_rays = len(points)
+                dist_lines = np.empty((num_rays, 2, 2))
+                dist_lines[:, 0, 0] = points[:, 1]
+                dist_lines[:, 0, 1] = points[:, 0]
+                dist_lines[:, 1, 0] = center[1]
+                dist_lines[:, 1, 1] = center[0]
+                lc = LineCollection(dist_lines, colors='green', linewidths=0.8, alpha=0.8, zorder=2)
+                ax.add_collection(lc)
+                
+                # Draw center point
+                ax.plot(center[1], center[0], 'ro', markersize=5, zorder=4)
+            
+            # Draw polygon boundary
+            a, b = list(points[:, 1]), list(points[:, 0])
+            a += a[:1]
+            b += b[:1]
+            ax.plot(a, b, '-', alpha=1, zorder=3, color=color, linewidth=2)
+            
+            # Add text info
+            info_text = f"Pixels: {pixel_count}\nArea (Poly): {poly_area:.1f}"
+            # if dists is not None:
+            #     info_text += f"\nMean Ray: {np.mean(dists):.1f}\nMax Ray: {np.max(dists):.1f}"
+                
+            # Display detailed dists in console if requested, or just summary on plot
+            # Display list of distances at the bottom
+            
+            if dists is not None:
+                plt.figtext(0.02, 0.02, f"Rays (64): {np.array2string(dists, precision=1, separator=', ', suppress_small=True)}", 
+                            fontsize=8, wrap=True, bbox=dict(facecolor='white', alpha=0.8))
+            
+            ax.text(0.05, 0.95, info_text, transform=ax.transAxes, verticalalignment='top', 
+                    bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
+
+            # Set view to focus on this bubble with some padding
+            min_x, max_x = min(points[:, 1]), max(points[:, 1])
+            min_y, max_y = min(points[:, 0]), max(points[:, 0])
+            padding = max(max_x - min_x, max_y - min_y) * 0.3
+            ax.set_xlim(min_x - padding, max_x + padding)
+            ax.set_ylim(max_y + padding, min_y - padding)  # Inverted y-axis for image
+            
+        elif item['type'] == 'ellipse':
+            params = item['params']
+            color = item['color']
+            y0, x0, a, b, phi = params
+            ellipse = Ellipse((y0, x0), 2*a, 2*b, angle=math.degrees(phi), alpha=0.5, color=color)
+            ax.add_artist(ellipse)
+            
+            # Draw center
+            ax.plot(y0, x0, 'ro', markersize=5, zorder=4)
+            
+            # Set view
+            padding = max(a, b) * 0.5
+            ax.set_xlim(y0 - a - padding, y0 + a + padding)
+            ax.set_ylim(x0 + b + padding, x0 - b - padding)
+        
+        ax.set_title(f'Bubble {idx + 1} Detail View')
+        ax.set_aspect('equal')
+        plt.tight_layout()
+        plt.show()
+
+    def on_key(self, event):
+        if event.key == 'right':
+            self.next()
+        elif event.key == 'left':
+            self.prev()
@@ -0,0 +1,148 @@
+import os
+import numpy as np
+from PIL import Image
+from skimage.draw import polygon, polygon_perimeter, line
+
+
+def toRGB(img):
+    """ Converts a grey value frame into an uint8 RGB buffer.
+
+    uint8 input is used as is, every other dtype is min/max scaled to [0,255]
+    (e.g. the float32 output of normalize()).
+    """
+    img = np.asarray(img)
+    if img.ndim == 3:
+        img = img[..., 0]
+    if img.dtype != np.uint8:
+        img = img.astype(np.float32)
+        lo, hi = np.nanmin(img), np.nanmax(img)
+        img = (img - lo) / max(hi - lo, 1e-20) * 255
+        img = np.clip(img, 0, 255).astype(np.uint8)
+    return np.repeat(img[..., np.newaxis], 3, axis=2)
+
+
+def _rgbColor(color):
+    color = np.asarray(color, dtype=float)[:3]
+    if color.max() <= 1:
+        color = color * 255
+    return np.clip(color, 0, 255).astype(np.uint8)
+
+
+def _blend(canvas, rr, cc, color, alpha):
+    if alpha >= 1:
+        canvas[rr, cc] = color
+    else:
+        canvas[rr, cc] = ((1 - alpha) * canvas[rr, cc] + alpha * color).astype(np.uint8)
+
+
+def _ellipsePoints(params, num_points=None):
+    # Same geometry as matplotlib's Ellipse((y0, x0), 2*a, 2*b, angle=phi) in BubbleStepper:
+    # params are (column, row, a, b, phi) with a along the rotated column axis.
+    y0, x0, a, b, phi = params
+    if num_points is None:
+        num_points = max(16, int(2 * np.pi * max(a, b)))
+    t = np.linspace(0, 2 * np.pi, num_points, endpoint=False)
+    cols = y0 + a * np.cos(t) * np.cos(phi) - b * np.sin(t) * np.sin(phi)
+    rows = x0 + a * np.cos(t) * np.sin(phi) + b * np.sin(t) * np.cos(phi)
+    return rows, cols
+
+
+def drawRays(canvas, center, points, color, alpha=0.7):
+    """ Draws the ray fan from center to each (y,x) endpoint into canvas. """
+    H, W = canvas.shape[:2]
+    r0, c0 = int(round(center[0])), int(round(center[1]))
+    for point in points:
+        rr, cc = line(r0, c0, int(point[0]), int(point[1]))
+        inside = (rr >= 0) & (rr < H) & (cc >= 0) & (cc < W)
+        _blend(canvas, rr[inside], cc[inside], color, alpha)
+
+
+def renderOverlay(img, VisualItems, draw_rays=False, ellipse_alpha=0.25):
+    """ Rasterizes reconstructed bubbles into an uint8 RGB image without matplotlib.
+
+    Parameters
+    ----------
+    img : ndarray
+        Background frame (grey values).
+    VisualItems: list
+        Visual items as returned by HiddenReco(..., boolPlot=True, return_visuals=True).
+    draw_rays: bool
+        Draw the ray fan of RDC reconstructed bubbles.
+    ellipse_alpha: float
+        Opacity of the filled ellipse fallbacks.
+
+    Returns
+    -------
+    ndarray
+        uint8 array (H,W,3).
+    """
+    canvas = toRGB(img)
+    shape = canvas.shape[:2]
+    for item in VisualItems:
+        color = _rgbColor(item['color'])
+        if item['type'] == 'rdc':
+            points = np.asarray(item['points'])
+            if draw_rays and item.get('center') is not None:
+                drawRays(canvas, item['center'], points, color)
+            rr, cc = polygon_perimeter(points[:, 0], points[:, 1], shape=shape)
+            canvas[rr, cc] = color
+        elif item['type'] == 'ellipse':
+            if not np.all(np.isfinite(item['params'])):
+                continue
+            rows, cols = _ellipsePoints(item['params'])
+            rr, cc = polygon(rows, cols, shape=shape)
+            _blend(canvas, rr, cc, color, ellipse_alpha)
+    return canvas
+
+
+class OverlayWriter:
+    """ Streams rendered overlays to disk, one frame at a time.
+
+    Parameters
+    ----------
+    path : str
+        Directory for per-frame PNGs, or a video file path ending in .mp4/.avi.
+    fps: float
+        Frame rate of the video output.
+    fourcc: str
+        Video codec, defaults to 'mp4v' for .mp4 and 'MJPG' for .avi.
+    """
+
+    def __init__(self, path, fps=10, fourcc=None):
+        self.path = path
+        self.fps = fps
+        ext = os.path.splitext(path)[1].lower()
+        self.video = ext in ('.mp4', '.avi')
+        if self.video:
+            self.fourcc = fourcc or ('MJPG' if ext == '.avi' else 'mp4v')
+        else:
+            os.makedirs(path, exist_ok=True)
+        self.writer = None
+        self.count = 0
+
+    def write(self, frame, name=None):
+        """ Appends an uint8 RGB frame (e.g. from renderOverlay). """
+        if self.video:
+            import cv2
+            if self.writer is None:
+                H, W = frame.shape[:2]
+                self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (W, H))
+                if not self.writer.isOpened():
+                    raise IOError(f"Unable to open video writer for {self.path}")
+            self.writer.write(np.ascontiguousarray(frame[..., ::-1]))
+        else:
+            if name is None:
+                name = f"frame_{self.count:05d}"
+            Image.fromarray(frame).save(os.path.join(self.path, name + '.png'))
+        self.count += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
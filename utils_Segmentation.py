@@ -1,18 +1,18 @@
-from mxnet import nd,gluon
-import mxnet as mx
 import numpy as np
-import skimage as ski
-from numpy.lib import stride_tricks as st
 import warnings
-from PIL import Image
-from numba import jit
+from utils_Kernels import controlled_dilation
+from utils_ROI import roiDilation
+
+# MXNet is only needed for the UNet path and imported lazily by the functions using it
 
 
 def load_img(path):
+    from PIL import Image
     x = np.array(Image.open(path).convert('L'))  
     return x
 
 def load_MXNet(homedir,ctx,sUnet3,sUnet5=None):   
+    from mxnet import gluon
     with warnings.catch_warnings():
        warnings.simplefilter("ignore")
        netMask = gluon.nn.SymbolBlock.imports(homedir+"UNetL3_V"+sUnet3+"-symbol.json",['data'],homedir+"UNetL3_V"+sUnet3+"-0000.params",ctx=ctx)
@@ -69,11 +69,14 @@ def createSubs(img,SizeX,SizeY,CropSize,divNum):
 def fixed_crop_new(src, x0, y0, w, h, size=None, interp=2):
     out = src[y0:y0+h, x0:x0+w]
     if size is not None and (w, h) != size:
+        import mxnet as mx
         sizes = (h, w, size[1], size[0])
         out = mx.image.imresize(out, *size, interp=mx.image._get_interp_method(interp, sizes))
     return out
 
 def predictionResize(sub,net,SizeX,SizeY,ctx):
+    from mxnet import nd
+    import mxnet as mx
     sub=sub.as_in_context(ctx)
     imgPred = net(nd.expand_dims(sub, 0))
     imgPred = nd.softmax(imgPred, axis=1)
@@ -97,6 +100,8 @@ def combineSubs(Subs,SizeX,SizeY,StartCoords,SubSizeX,SubSizeY):
     return NewIm.astype(np.uint8)
 
 def fillSmallHoles(img, size, Value,connectivity):
+    import skimage as ski
+    import skimage.measure
     labels = ski.measure.label(img, connectivity=connectivity)
     props = ski.measure.regionprops_table(
         labels, img, properties=['label', 'area'])
@@ -105,7 +110,13 @@ def fillSmallHoles(img, size, Value,connectivity):
             img = np.where(labels == count, Value, img)
     return img
 
-def createLabelUNet(img,divNum,netMask,CropSize,fillsize,ctxMask=mx.cpu(0),ctxInter=mx.cpu(0),netInter=None):
+def createLabelUNet(img,divNum,netMask,CropSize,fillsize,ctxMask=None,ctxInter=None,netInter=None):
+    from mxnet import nd
+    import mxnet as mx
+    if ctxMask is None:
+        ctxMask=mx.cpu(0)
+    if ctxInter is None:
+        ctxInter=mx.cpu(0)
     SizeY=len(img)
     SizeX=len(img[0])
     Subs,StartCoords=createSubs(img,SizeX,SizeY,CropSize,divNum)
@@ -143,74 +154,15 @@ def checkLabelsforMask(labelsSD,imgMask):
         if np.count_nonzero(imgMask[points[:,0],points[:,1]])==0:
             labelsSD[points[:,0],points[:,1]]=0
 
-try:
-    from numpy.lib.stride_tricks import sliding_window_view as _swv
-    def _sliding_window_view(a, win): return _swv(a, win)
-except Exception:
-    from numpy.lib.stride_tricks import as_strided
-    def _sliding_window_view(a, win):
-        h, w = a.shape
-        wh, ww = win
-        out_shape = (h - wh + 1, w - ww + 1, wh, ww)
-        out_strides = a.strides + a.strides
-        return as_strided(a, shape=out_shape, strides=out_strides, writeable=False)
-
-# @jit(nopython=True)
-# def controlled_dilation(labels, LabelsNeighbors, imgMask, imgIntersec):
-#     labels_copy = labels.copy()
-#     dilated = False
-#     for i in range(len(labels)):
-#         for j in range(len(labels[0])):
-#             if (labels[i, j] > 0) and (np.count_nonzero(LabelsNeighbors[i, j]) < 9):
-#                 for e in range(3):
-#                     for ee in range(3):
-#                         if (i+e-1 >= 0) and (j+ee-1 >= 0) and (i+e-1 < len(labels)) and (j+ee-1 < len(labels[0])):
-#                             if (LabelsNeighbors[i, j, e, ee] == 0) and (imgMask[i+e-1, j+ee-1] > 0) and (imgIntersec[i+e-1, j+ee-1] == 0):
-#                                 labels_copy[i+e-1, j+ee-1] = labels[i, j]
-#                                 dilated = True
-#     return labels_copy, dilated
-def controlled_dilation(labels, LabelsNeighbors, imgMask, imgIntersec):
-     # Pure NumPy/Python version (no numba)
-     H, W = labels.shape
-     labels_copy = labels.copy()
-     dilated = False
-     for i in range(H):
-         for j in range(W):
-             if labels[i, j] > 0 and (np.count_nonzero(LabelsNeighbors[i, j]) < 9):
-                 for e in range(3):
-                     for ee in range(3):
-                         ni, nj = i + e - 1, j + ee - 1
-                         if 0 <= ni < H and 0 <= nj < W:
-                             if (LabelsNeighbors[i, j, e, ee] == 0) and (imgMask[ni, nj] > 0) and (imgIntersec[ni, nj] == 0):
-                                 labels_copy[ni, nj] = labels[i, j]
-                                 dilated = True
-     return labels_copy, dilated
-
-def dilateToMask(labels,imgMask,imgIntersec):
-    # Cast all arrays to int32 for numba compatibility
-    # labels = np.ascontiguousarray(labels, dtype=np.int32)
-    # imgMask = np.ascontiguousarray(imgMask, dtype=np.int32)
-    # imgIntersec = np.ascontiguousarray(imgIntersec, dtype=np.int32)
-
-    # LabelsNeighbors = st.sliding_window_view(np.pad(labels, 1), (3, 3))
-    # LabelsNeighbors = np.ascontiguousarray(LabelsNeighbors, dtype=np.int32)
-
-    # Keep original dtypes; just ensure C-contiguous
-    labels = np.ascontiguousarray(labels)
-    imgMask = np.ascontiguousarray(imgMask)
-    imgIntersec = np.ascontiguousarray(imgIntersec)
-
-    LabelsNeighbors = _sliding_window_view(np.pad(labels, 1), (3, 3))
-
-    labels_copy, dilated = controlled_dilation(
-        labels, LabelsNeighbors, imgMask, imgIntersec)
+def dilateToMask(labels,imgMask,imgIntersec,roi=True):
+    # Grows the labels step by step into the mask, each step is one pass of the compiled
+    # (or vectorized NumPy) controlled_dilation kernel from utils_Kernels. With roi the steps
+    # after the first only run around the pixels filled before (utils_ROI)
+    if roi:
+        return roiDilation(labels, imgMask, imgIntersec)
+    labels_copy, dilated = controlled_dilation(labels, imgMask, imgIntersec)
     while(dilated):
-        # LabelsNeighbors = st.sliding_window_view(
-        #     np.pad(labels_copy, 1), (3, 3))
-        # LabelsNeighbors = np.ascontiguousarray(LabelsNeighbors, dtype=np.int32)
-        LabelsNeighbors = _sliding_window_view(np.pad(labels_copy, 1), (3, 3))
-        labels_copy, dilated = controlled_dilation(
-            labels_copy, LabelsNeighbors, imgMask, imgIntersec)
+        labels_copy, dilated = controlled_dilation(labels_copy, imgMask, imgIntersec)
     return labels_copy  
 
 def combinedPrediction(X,modelSD,imgMask,imgIntersec):
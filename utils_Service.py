@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Long-lived local inference service: loads StarDist and the RDC net once and serves bubble tables.
+
+Start:  python utils_Service.py --models Models/ --port 8765
+Client: InferenceClient().predict_path('Examples/img/frame_0180.png', metric=5.2E-2)
+"""
+
+import os
+import io
+import json
+import base64
+import argparse
+import threading
+import urllib.request
+import urllib.parse
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from utils_FrameLoader import load_frame, normalizeFrame
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+BUBBLE_FIELDS = ('ID', 'Position', 'Diameter', 'Major', 'Minor', 'Volume', 'Timestep', 'Rays')
+
+
+def _encodeArray(arr):
+    buf = io.BytesIO()
+    np.save(buf, arr, allow_pickle=False)
+    return base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def _decodeArray(data):
+    return np.load(io.BytesIO(base64.b64decode(data)), allow_pickle=False)
+
+
+def _jsonDefault(o):
+    if hasattr(o, 'tolist'):
+        return o.tolist()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def bubblesToTable(Bubbles):
+    return [{k: getattr(bub, k) for k in BUBBLE_FIELDS} for bub in Bubbles]
+
+
+def bubblesFromTable(table):
+    from utils_StarBub import Bubble
+    Bubbles = []
+    for row in table:
+        Bubbles.append(Bubble(None, None, Diameter=row['Diameter'], Position=tuple(row['Position']), Major=row['Major'],
+                              Minor=row['Minor'], Volume=row['Volume'], Timestep=row['Timestep'], ID=row['ID'],
+                              Rays=None if row['Rays'] is None else np.asarray(row['Rays'])))
+    return Bubbles
+
+
+def visualsFromJSON(items):
+    VisualItems = []
+    for item in items:
+        item = dict(item)
+        if 'points' in item:
+            item['points'] = np.asarray(item['points'], dtype=int)
+        if item.get('dists') is not None:
+            item['dists'] = np.asarray(item['dists'])
+        for key in ('center', 'params', 'color'):
+            if item.get(key) is not None:
+                item[key] = tuple(item[key])
+        VisualItems.append(item)
+    return VisualItems
+
+
+class InferenceService:
+    """ Holds the StarDist and RDC models and runs the full frame -> bubble table pipeline.
+
+    Parameters
+    ----------
+    model_dir : str
+        Directory containing SDmodel/ and RDC/ (as Models/ used by demo.py).
+    sd_name: str
+        StarDist model name.
+    rdc_file: str
+        RDC model file relative to model_dir.
+    metric: float
+        Default pixel size.
+    use_gpu: bool
+        Allow TensorFlow to use the GPU.
+    """
+
+    def __init__(self, model_dir, sd_name='data_mix_64_400', rdc_file='RDC/rdc_model_mm.h5', metric=5.2E-2, use_gpu=False):
+        os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+        if not use_gpu:
+            os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+        import tensorflow as tf
+        from stardist.models import StarDist2D
+        if use_gpu:
+            for device in tf.config.list_physical_devices('GPU'):
+                tf.config.experimental.set_memory_growth(device, True)
+        self.metric = metric
+        self.modelSD = StarDist2D(None, name=sd_name, basedir=os.path.join(model_dir, 'SDmodel'))
+        self.model = tf.keras.models.load_model(os.path.join(model_dir, rdc_file))
+        # Keras/StarDist models are shared between the request threads
+        self.lock = threading.Lock()
+
+    def predict(self, x, metric=None, useRDC=True, timestep=0, return_labels=False, return_visuals=False,
+                normalized=False):
+        # normalized: x is already percentile normalized (e.g. by utils_FrameLoader.FrameSource)
+        from utils_StarBub import reconstructBubbles, visualItems
+        metric = self.metric if metric is None else metric
+        X = x if normalized else normalizeFrame(x if x.ndim == 2 else x[..., 0], 1, 99.8)
+        with self.lock:
+            labels, _ = self.modelSD.predict_instances(X, verbose=False)
+        # Only the model calls are serialized, the reconstruction of concurrent requests overlaps
+        results = reconstructBubbles(labels, metric, model=self.model, useRDC=useRDC, timestep=timestep, lock=self.lock)
+        result = {'bubbles': bubblesToTable(results)}
+        if return_labels:
+            result['labels'] = _encodeArray(labels)
+        if return_visuals:
+            result['visuals'] = visualItems(results)
+        return result
+
+
+def _options(params):
+    opts = {}
+    if 'metric' in params:
+        opts['metric'] = float(params['metric'])
+    if 'timestep' in params:
+        opts['timestep'] = float(params['timestep'])
+    for key in ('useRDC', 'return_labels', 'return_visuals'):
+        if key in params:
+            value = params[key]
+            opts[key] = value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes')
+    return opts
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """ HTTP server with GET /health and POST /predict.
+
+    /predict accepts either JSON {"path": ..., options} or a raw .npy body
+    (Content-Type application/x-npy) with the options in the query string.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, code, payload):
+            body = json.dumps(payload, default=_jsonDefault).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urllib.parse.urlparse(self.path).path == '/health':
+                self._reply(200, {'status': 'ok'})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path != '/predict':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.headers.get('Content-Type', '').startswith('application/x-npy'):
+                    x = np.load(io.BytesIO(body), allow_pickle=False)
+                    params = dict(urllib.parse.parse_qsl(url.query))
+                else:
+                    params = json.loads(body)
+                    x = load_frame(params['path'])
+                self._reply(200, service.predict(x, **_options(params)))
+            except Exception as e:
+                self._reply(500, {'error': f"{type(e).__name__}: {e}"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+class InferenceClient:
+    """ Thin client for a running InferenceService.
+
+    predict_path/predict_array return (Bubbles, labels, VisualItems); labels and VisualItems
+    are None unless requested with return_labels/return_visuals.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=600):
+        self.url = f"http://{host}:{port}"
+        self.timeout = timeout
+
+    def available(self):
+        try:
+            with urllib.request.urlopen(self.url + '/health', timeout=2) as r:
+                return json.loads(r.read()).get('status') == 'ok'
+        except (urllib.error.URLError, OSError, ValueError):
+            return False
+
+    def _post(self, url, body, content_type):
+        req = urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as r:
+                result = json.loads(r.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.loads(e.read()).get('error', str(e)))
+        Bubbles = bubblesFromTable(result['bubbles'])
+        labels = _decodeArray(result['labels']) if 'labels' in result else None
+        VisualItems = visualsFromJSON(result['visuals']) if 'visuals' in result else None
+        return Bubbles, labels, VisualItems
+
+    def predict_path(self, path, **opts):
+        """ Frame file readable by the service (shared filesystem). """
+        payload = dict(opts, path=os.path.abspath(path))
+        return self._post(self.url + '/predict', json.dumps(payload).encode('utf-8'), 'application/json')
+
+    def predict_array(self, x, **opts):
+        """ Raw (not normalized) frame array. """
+        buf = io.BytesIO()
+        np.save(buf, np.asarray(x), allow_pickle=False)
+        query = urllib.parse.urlencode(opts)
+        return self._post(self.url + '/predict?' + query, buf.getvalue(), 'application/x-npy')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local StarDist + RDC inference service')
+    parser.add_argument('--models', default=os.path.join(os.path.abspath(''), 'Models'), help='model directory')
+    parser.add_argument('--sd-name', default='data_mix_64_400')
+    parser.add_argument('--rdc', default='RDC/rdc_model_mm.h5', help='RDC model relative to --models')
+    parser.add_argument('--metric', type=float, default=5.2E-2, help='default pixel size')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--gpu', action='store_true')
+    args = parser.parse_args()
+
+    print("Loading models...")
+    service = InferenceService(args.models, args.sd_name, args.rdc, args.metric, args.gpu)
+    server = make_server(service, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,19 +1,14 @@
 import numpy as np
-from numpy.lib import stride_tricks as st
-from skimage.draw import polygon_perimeter,polygon
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
 import math
 import numpy.linalg as lag
 import csv
-from PIL import Image
-from matplotlib.patches import Ellipse
-from skimage.measure import EllipseModel
-import json
-from scipy.ndimage.filters import uniform_filter1d
-from scipy.ndimage import gaussian_filter1d
-from scipy.interpolate import interp1d
-from matplotlib.widgets import Button
+from collections import namedtuple
+from utils_Descriptors import rayDescriptors
+import utils_Kernels as kernels
+from utils_ROI import labelBoxes, boxOffset, ROI_MARGIN
+
+# Plotting (matplotlib) lives in utils_Plot and scikit-image is imported where it is needed,
+# so headless workers that only reconstruct bubbles do not pay for these imports.
 
 
 
@@ -43,8 +38,10 @@ class RDObj():
         self.dists = dists
         self.points=points
 
-    def getCenter(self,img):
+    def getCenter(self,img,offset=(0,0)):
         points=np.argwhere(img==self.id)
+        if offset!=(0,0):
+            points+=offset
         if len(points)>0:
             self.center=(np.mean(points[:,0]),np.mean(points[:,1]))
 
@@ -53,63 +50,34 @@ class RDObj():
             return True
         return False
 
-    def generateRD_manual(self,img):
+    def generateRD_manual(self,img,offset=(0,0),frame_shape=None):
+        # img may be a crop (utils_ROI) at offset of a frame of frame_shape, center and points
+        # stay in frame coordinates
         phis = np.linspace(0,2*np.pi,self.num_rays,endpoint=False)
         if (self.center is None):
-            self.getCenter(img)   
+            self.getCenter(img,offset)   
         if (self.center is None):
             return   
-        distx=np.ones(phis.shape)*np.cos(phis)
-        disty=np.ones(phis.shape)*np.sin(phis)
-        stretch=5
+        # Ray stretching and touching detection run in the compiled kernels of utils_Kernels
+        stretched=kernels.stretch_rays(img,self.id,self.center,np.sin(phis),np.cos(phis),offset,frame_shape)
         points=np.zeros((len(phis),3))
-        StretchBool=True
-        mask=img!=self.id
-        mask[:,0]=1
-        mask[:,len(mask[0])-1]=1
-        mask[0,:]=1
-        mask[len(mask)-1,:]=1
-        while StretchBool:
-            points_strechted=[(self.center[0]+disty*stretch),(self.center[1]+distx*stretch)] 
-            points_strechted[0]=np.where(points_strechted[0]<0,0,points_strechted[0])
-            points_strechted[1]=np.where(points_strechted[1]<0,0,points_strechted[1])
-            points_strechted[0]=np.where(points_strechted[0]>=len(img)-1,len(img)-1,points_strechted[0])
-            points_strechted[1]=np.where(points_strechted[1]>=len(img[0])-1,len(img[0])-1,points_strechted[1])
-            touch_mask=mask[points_strechted[0].astype(int),points_strechted[1].astype(int)]
-            compare=((points[:,2]!=1)&(touch_mask==1))
-            points[:,0]+=(self.center[0]+disty*(stretch-1))*compare
-            points[:,1]+=(self.center[1]+distx*(stretch-1))*compare
-            points[:,2]=np.where(compare==1,1,points[:,2])
-            stretch+=1
-            if (np.count_nonzero(points[:,2]==0)==0):
-                StretchBool=False  
-
+        points[:,:2]=stretched
         self.dists=np.sqrt(np.square(self.center[0]-points[:,0])+np.square(self.center[1]-points[:,1]))       
-        points[:,2]=0
         self.points=points.astype(int)
-        self.getTouchingCandidates(img)
+        self.getTouchingCandidates(img,offset,frame_shape)
 
-    def getTouchingCandidates(self,img):
-        LabelNeighbors = st.sliding_window_view(np.pad(img, 1), (3, 3))    
-        for point in self.points:
-            if (point[0]<len(img))and(point[1]<len(img[0]))and(point[0]>=0)and(point[1]>=0):
-                if (np.count_nonzero(LabelNeighbors[int(point[0]),int(point[1])]==0)==0)or(self.touchImgBorder(img,int(point[0]),int(point[1]))==True):
-                    point[2]=1
-            else:
-                point[2]=1
+    def getTouchingCandidates(self,img,offset=(0,0),frame_shape=None):
+        self.points[:,2]=kernels.touching_candidates(img,self.points,offset,frame_shape)
 
     def transformRDToArray(self,metric):
         RDArray=self.dists*metric
         return RDArray
 
     def stretchPoints(self,stretch):
-        phis = np.linspace(0,2*np.pi,self.num_rays,endpoint=False) 
-        distx=np.ones(phis.shape)*np.cos(phis)
-        disty=np.ones(phis.shape)*np.sin(phis)
-        self.points[:,0]=(self.center[0]+disty*stretch).astype(int) 
-        self.points[:,1]=(self.center[1]+distx*stretch).astype(int) 
+        self.points[:,:2]=stretchedPoints(self.center,stretch,self.num_rays)[:,:2]
 
     def drawRD(self,ax,color='g',linewidths=0.6):
+        from matplotlib.collections import LineCollection
         dist_lines=np.empty((self.num_rays,2,2))
         if len(self.points)==0:
             print("No Endpoints evaluated so far. Try generateRD_manual() function")
@@ -217,320 +185,218 @@ class Bubble():
         else:
             return [str(self.Position[1]),str(self.Position[0]),str(self.Diameter),str(self.Major),str(self.Minor),str(self.Velocity),str(self.Timestep),str(self.ID)]
 
-class BubbleStepper:
-    def __init__(self, ax, visual_items, background_img=None):
-        self.ax = ax
-        self.visual_items = visual_items
-        self.background_img = background_img
-        self.current_idx = -1
-        self.artists = [] 
-        self.detail_fig = None
-        
-        plt.subplots_adjust(bottom=0.2)
-        ax_prev = plt.axes([0.7, 0.05, 0.1, 0.075])
-        ax_next = plt.axes([0.81, 0.05, 0.1, 0.075])
-        self.bnext = Button(ax_next, 'Next')
-        self.bprev = Button(ax_prev, 'Prev')
-        self.bnext.on_clicked(self.next)
-        self.bprev.on_clicked(self.prev)
-        
-        self.ax.figure.canvas.mpl_connect('key_press_event', self.on_key)
-        self.ax.figure.canvas.mpl_connect('button_press_event', self.on_click)
-        print("Interactive Mode: Press Right/Next to draw bubble, Left/Prev to undo. Click on bubble to view detail with rays.")
-        plt.show(block=True)
-
-    def next(self, event=None):
-        if self.current_idx < len(self.visual_items) - 1:
-            self.current_idx += 1
-            item = self.visual_items[self.current_idx]
-            self.draw_item(item)
-            self.ax.figure.canvas.draw_idle()
-
-    def prev(self, event=None):
-        if self.current_idx >= 0:
-            if self.artists:
-                last_artists = self.artists.pop()
-                for art in last_artists:
-                    art.remove()
-                self.current_idx -= 1
-                self.ax.figure.canvas.draw_idle()
-
-    def draw_item(self, item, draw_rays=False):
-        new_artists = []
-        if item['type'] == 'rdc':
-            points = item['points']
-            color = item['color']
-            a,b = list(points[:,1]),list(points[:,0])
-            a += a[:1]
-            b += b[:1]
-            lines = self.ax.plot(a,b, '-', alpha=1, zorder=1, color=color, linewidth=1.5)
-            new_artists.extend(lines)
-            
-            # Draw rays if requested and center is available
-            if draw_rays and 'center' in item:
-                center = item['center']
-                num_rays = len(points)
-                dist_lines = np.empty((num_rays, 2, 2))
-                dist_lines[:, 0, 0] = points[:, 1]
-                dist_lines[:, 0, 1] = points[:, 0]
-                dist_lines[:, 1, 0] = center[1]
-                dist_lines[:, 1, 1] = center[0]
-                lc = LineCollection(dist_lines, colors=color, linewidths=0.6, alpha=0.7)
-                self.ax.add_collection(lc)
-                new_artists.append(lc)
-                
-        elif item['type'] == 'ellipse':
-            params = item['params']
-            color = item['color']
-            y0, x0, a, b, phi = params
-            ellipse = Ellipse((y0, x0), 2*a, 2*b, angle=math.degrees(phi), alpha=0.25, color=color)
-            self.ax.add_artist(ellipse)
-            new_artists.append(ellipse)
-        self.artists.append(new_artists)
-    
-    def on_click(self, event):
-        """Handle click event to show clicked bubble with rays in a new figure"""
-        if event.inaxes != self.ax:
-            return
-        
-        click_x, click_y = event.xdata, event.ydata
-        
-        # Find which bubble was clicked (check only drawn bubbles)
-        for idx in range(self.current_idx + 1):
-            item = self.visual_items[idx]
-            if item['type'] == 'rdc':
-                points = item['points']
-                center = item.get('center', None)
-                if center is None:
-                    continue
-                
-                # Check if click is inside the bubble polygon
-                from matplotlib.path import Path
-                polygon_path = Path(np.column_stack([points[:, 1], points[:, 0]]))
-                if polygon_path.contains_point((click_x, click_y)):
-                    self.show_bubble_detail(item, idx)
-                    return
-            elif item['type'] == 'ellipse':
-                params = item['params']
-                y0, x0, a, b, phi = params
-                # Simple distance check for ellipse
-                dx = click_x - y0
-                dy = click_y - x0
-                # Rotate point to ellipse coordinate system
-                cos_phi = np.cos(-phi)
-                sin_phi = np.sin(-phi)
-                dx_rot = dx * cos_phi - dy * sin_phi
-                dy_rot = dx * sin_phi + dy * cos_phi
-                # Check if inside ellipse
-                if (dx_rot**2 / a**2 + dy_rot**2 / b**2) <= 1:
-                    self.show_bubble_detail(item, idx)
-                    return
-    
-    def show_bubble_detail(self, item, idx):
-        """Show a new figure with only the clicked bubble and its rays"""
-        # Close previous detail figure if it exists
-        if self.detail_fig is not None and plt.fignum_exists(self.detail_fig.number):
-            plt.close(self.detail_fig)
-            
-        fig, ax = plt.subplots(figsize=(8, 8))
-        self.detail_fig = fig
-        
-        if self.background_img is not None:
-            ax.imshow(self.background_img, cmap='gray')
-        
-        if item['type'] == 'rdc':
-            points = item['points']
-            color = item['color']
-            center = item.get('center', None)
-            dists = item.get('dists', None)
-            pixel_count = item.get('pixel_count', 'N/A')
-            
-            # Calculate area (approximate via polygon)
-            # from skimage.measure import moments_polygon # REMOVED: Causing ImportError and not needed (using Shoelace formula below)
-            if len(points) > 2:
-                # points are (y, x)
-                poly_area = 0.5 * np.abs(np.dot(points[:, 1], np.roll(points[:, 0], 1)) - np.dot(points[:, 0], np.roll(points[:, 1], 1)))
-            else:
-                poly_area = 0
-            
-            # Draw rays first (behind the polygon)
-            if center is not None:
-                num_rays = len(points)
-                dist_lines = np.empty((num_rays, 2, 2))
-                dist_lines[:, 0, 0] = points[:, 1]
-                dist_lines[:, 0, 1] = points[:, 0]
-                dist_lines[:, 1, 0] = center[1]
-                dist_lines[:, 1, 1] = center[0]
-                lc = LineCollection(dist_lines, colors='green', linewidths=0.8, alpha=0.8, zorder=2)
-                ax.add_collection(lc)
-                
-                # Draw center point
-                ax.plot(center[1], center[0], 'ro', markersize=5, zorder=4)
-            
-            # Draw polygon boundary
-            a, b = list(points[:, 1]), list(points[:, 0])
-            a += a[:1]
-            b += b[:1]
-            ax.plot(a, b, '-', alpha=1, zorder=3, color=color, linewidth=2)
-            
-            # Add text info
-            info_text = f"Pixels: {pixel_count}\nArea (Poly): {poly_area:.1f}"
-            # if dists is not None:
-            #     info_text += f"\nMean Ray: {np.mean(dists):.1f}\nMax Ray: {np.max(dists):.1f}"
-                
-            # Display detailed dists in console if requested, or just summary on plot
-            # Display list of distances at the bottom
-            
-            if dists is not None:
-                plt.figtext(0.02, 0.02, f"Rays (64): {np.array2string(dists, precision=1, separator=', ', suppress_small=True)}", 
-                            fontsize=8, wrap=True, bbox=dict(facecolor='white', alpha=0.8))
-            
-            ax.text(0.05, 0.95, info_text, transform=ax.transAxes, verticalalignment='top', 
-                    bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
-
-            # Set view to focus on this bubble with some padding
-            min_x, max_x = min(points[:, 1]), max(points[:, 1])
-            min_y, max_y = min(points[:, 0]), max(points[:, 0])
-            padding = max(max_x - min_x, max_y - min_y) * 0.3
-            ax.set_xlim(min_x - padding, max_x + padding)
-            ax.set_ylim(max_y + padding, min_y - padding)  # Inverted y-axis for image
-            
-        elif item['type'] == 'ellipse':
-            params = item['params']
-            color = item['color']
-            y0, x0, a, b, phi = params
-            ellipse = Ellipse((y0, x0), 2*a, 2*b, angle=math.degrees(phi), alpha=0.5, color=color)
-            ax.add_artist(ellipse)
-            
-            # Draw center
-            ax.plot(y0, x0, 'ro', markersize=5, zorder=4)
-            
-            # Set view
-            padding = max(a, b) * 0.5
-            ax.set_xlim(y0 - a - padding, y0 + a + padding)
-            ax.set_ylim(x0 + b + padding, x0 - b - padding)
-        
-        ax.set_title(f'Bubble {idx + 1} Detail View')
-        ax.set_aspect('equal')
-        plt.tight_layout()
-        plt.show()
-
-    def on_key(self, event):
-        if event.key == 'right':
-            self.next()
-        elif event.key == 'left':
-            self.prev()
-
-def HiddenReco(labels,metric,timestep=0,useRDC=False,model=None,boolPlot=False,ax=None,OnlyPoints=False,step_plot=True,return_visuals=False):
-    if ax is None and boolPlot:
-        ax = plt.gca()
-    if model==None:
-        useRDC=False
-    if useRDC==False:
-        ell=EllipseModel()
-    n_rays=64
-    Bubbles=[]
-    VisualItems=[]
-    
-    for i in range(1,np.max(labels)+1):
+BubbleResult = namedtuple('BubbleResult', ['ID', 'Kind', 'Position', 'Diameter', 'Major', 'Minor', 'Volume', 'Timestep',
+                                           'Rays', 'Points', 'Center', 'PixelCount', 'Ellipse'])
+BubbleResult.__doc__ = """ Immutable reconstruction result of one bubble (see reconstructBubbles).
+
+Kind is 'rdc' (ray based) or 'ellipse'. Rays and Points (ray end points y,x,touching) are
+read-only arrays of 'rdc' results, Ellipse holds the (y0,x0,a,b,phi) fit of 'ellipse' results.
+The other fields are the Bubble attributes of the same name.
+"""
+
+
+def _readonly(a):
+    a = np.array(a)
+    a.flags.writeable = False
+    return a
+
+
+def stretchedPoints(center,stretch,num_rays,flags=None):
+    """ New (num_rays,3) int ray end points for ray lengths stretch around center (RDObj.stretchPoints
+    without modifying the object). flags fills the touching column.
+    """
+    phis = np.linspace(0,2*np.pi,num_rays,endpoint=False)
+    points=np.zeros((num_rays,3),dtype=int)
+    points[:,0]=(center[0]+np.sin(phis)*stretch).astype(int)
+    points[:,1]=(center[1]+np.cos(phis)*stretch).astype(int)
+    if flags is not None:
+        points[:,2]=flags
+    return points
+
+def labelRays(labels,n_rays=64,margin=ROI_MARGIN):
+    """ RDObj of every label of the frame in ID order, labels without pixels are skipped.
+
+    Each label is processed on its bounding box grown by margin (utils_ROI), margin=None scans the
+    full frame per label instead. Both give the same rays for margin >= 6.
+    """
+    objs=[]
+    if margin is None:
+        for i in range(1,np.max(labels)+1):
+            Rdc=RDObj(i,n_rays)
+            Rdc.generateRD_manual(labels)
+            if Rdc.center is not None:
+                objs.append(Rdc)
+        return objs
+    labels=np.asarray(labels)
+    for i,box in labelBoxes(labels,margin):
         Rdc=RDObj(i,n_rays)
-        Rdc.generateRD_manual(labels)
-        if (Rdc.center!=None):      
-            if useRDC:
-                if (np.count_nonzero(Rdc.points[:,2]==1)>1):
-                    # dung model
-                    RDArray=Rdc.transformRDToArray(metric)
-                    yhat = model.predict(np.asarray([RDArray]))
-                    stretch=yhat[0]/metric
-                    # stretch=np.where(stretch*Rdc.points[:,2]>Rdc.dists,stretch,Rdc.dists)
-                    # stretch=uniform_filter1d(stretch,size=4)
-                    Rdc.stretchPoints(stretch)
-                    Rdc.dists = stretch
-
-                if OnlyPoints:
-                    points=Rdc.points[:,:2]
-                    Bubbles.append((i,points))
-                if boolPlot:
-                    random_color=tuple((np.random.choice(range(255),size=3))/255)
-                    VisualItems.append({
-                        'type': 'rdc',
-                        'points': Rdc.points.copy(),
-                        'center': Rdc.center,
-                        'dists': Rdc.dists.copy() if Rdc.dists is not None else None,
-                        'pixel_count': np.count_nonzero(labels==i),
-                        'color': random_color,
-                    })
-                
-                if OnlyPoints==False:    
-                    Bub=Bubble(Rdc.points,metric,Timestep=timestep,ID=i,Rays=Rdc.dists)
-                    if Bub.Diameter is not None:
-                        Bubbles.append(Bub)
-            else:
-                pointsEllipse=[]
-                pointsbackup=[]
-                ell=EllipseModel()
-                for point in Rdc.points:
-                    if point[2]==0:
-                        pointsEllipse.append([point[0],point[1]])
-                    pointsbackup.append([point[0],point[1]])
-                areaEllipse=0
-                if len(pointsEllipse)>0:
-                    pointsEllipse=np.array(pointsEllipse)
-                    ell.estimate(pointsEllipse)
-                    try:
-                        x0,y0,a,b,phi1=ell.params
-                        phi=0.5*np.pi-phi1
-                        areaEllipse=math.pi*a*b
-                    except:
-                        areaEllipse=0
-                        print('Error in ellipse fit, retry with backup')
-                if (areaEllipse<np.count_nonzero(labels==i))or(areaEllipse>20*np.count_nonzero(labels==i)):
-                    pointsEllipse=np.array(pointsbackup)
-                    ell.estimate(pointsEllipse)
-                    try:
-                        x0,y0,a,b,phi1=ell.params
-                        phi=0.5*np.pi-phi1
-                        areaEllipse=math.pi*a*b
-                    except:
-                        areaEllipse=0
-                        print(f'Unable to fit ellipse for label {i}')
-                if boolPlot:
-                    random_color=tuple((np.random.choice(range(255),size=3))/255)
-                    VisualItems.append({
-                        'type': 'ellipse',
-                        'params': (y0, x0, a, b, phi),
-                        'color': random_color
-                    })
-                if math.isnan(areaEllipse)==False:
-                    major_el=a if a > b else b
-                    minor_el=b if b < a else a
-                    major_el=major_el*metric
-                    minor_el=minor_el*metric
-                    V_Ellipsoid=math.pi*4/3*major_el**2*minor_el
-                    d_Sphere=(6*V_Ellipsoid/math.pi)**(1/3)
-                    Bubbles.append(Bubble(None,None,Diameter=d_Sphere,Position=[y0,x0],Major=a,Minor=b,Volume=V_Ellipsoid,Timestep=timestep))
+        Rdc.generateRD_manual(labels[box],boxOffset(box),labels.shape)
+        if Rdc.center is not None:
+            objs.append(Rdc)
+    return objs
+
+def predictRays(objs,model,metric,lock=None):
+    """ (points, dists) of each RDObj. Objects with more than one touching ray are reconstructed
+    by the RDC model in a single batched predict call, the RDObj are not modified.
+
+    lock (e.g. threading.Lock) serializes the model call when the model is shared between threads.
+    """
+    rays=[(Rdc.points,Rdc.dists) for Rdc in objs]
+    todo=[k for k,Rdc in enumerate(objs) if np.count_nonzero(Rdc.points[:,2]==1)>1]
+    if todo:
+        X=np.asarray([objs[k].transformRDToArray(metric) for k in todo])
+        if lock is None:
+            yhat=model.predict(X,batch_size=4096)
+        else:
+            with lock:
+                yhat=model.predict(X,batch_size=4096)
+        for k,y in zip(todo,yhat):
+            stretch=y/metric
+            rays[k]=(stretchedPoints(objs[k].center,stretch,objs[k].num_rays,objs[k].points[:,2]),stretch)
+    return rays
+
+def rdcResults(objs,rays,pixel_counts,metric,timestep=0,fastProps=False):
+    """ BubbleResults of ray based objects, rays as returned by predictRays. """
+    if fastProps and len(objs)>0:
+        props=rayDescriptors(np.array([d for _,d in rays],dtype=float),np.array([Rdc.center for Rdc in objs],dtype=float),metric)
+    results=[]
+    for k,(Rdc,(points,dists)) in enumerate(zip(objs,rays)):
+        if fastProps:
+            if not props['Area'][k]>0:
+                continue
+            Position,Diameter,Major,Minor,Volume=tuple(Rdc.center),props['Diameter'][k],props['Major'][k],props['Minor'][k],props['Volume'][k]
+        else:
+            Bub=Bubble(points,metric,Timestep=timestep,ID=Rdc.id,Rays=dists)
+            if Bub.Diameter is None:
+                continue
+            Position,Diameter,Major,Minor,Volume=tuple(Bub.Position),Bub.Diameter,Bub.Major,Bub.Minor,Bub.Volume
+        results.append(BubbleResult(Rdc.id,'rdc',Position,Diameter,Major,Minor,Volume,timestep,_readonly(dists),
+                                    _readonly(points),tuple(Rdc.center),int(pixel_counts[Rdc.id]),None))
+    return results
+
+def _estimateEllipse(points):
+    from skimage.measure import EllipseModel
+    ell=EllipseModel()
+    ell.estimate(np.array(points))
+    try:
+        x0,y0,a,b,phi1=ell.params
+    except:
+        return None,0
+    return (y0,x0,a,b,0.5*np.pi-phi1),math.pi*a*b
+
+def ellipseResult(Rdc,pixel_count,metric,timestep=0):
+    """ BubbleResult of an ellipse fitted to the non touching ray end points (all end points if that
+    fit is implausible), None if no ellipse can be fitted.
+    """
+    params,areaEllipse=None,0
+    inner=Rdc.points[Rdc.points[:,2]==0,:2]
+    if len(inner)>0:
+        params,areaEllipse=_estimateEllipse(inner)
+        if params is None:
+            print('Error in ellipse fit, retry with backup')
+    if (areaEllipse<pixel_count)or(areaEllipse>20*pixel_count):
+        params,areaEllipse=_estimateEllipse(Rdc.points[:,:2])
+        if params is None:
+            print(f'Unable to fit ellipse for label {Rdc.id}')
+    if params is None or math.isnan(areaEllipse):
+        return None
+    y0,x0,a,b,phi=params
+    major_el=max(a,b)*metric
+    minor_el=min(a,b)*metric
+    V_Ellipsoid=math.pi*4/3*major_el**2*minor_el
+    d_Sphere=(6*V_Ellipsoid/math.pi)**(1/3)
+    return BubbleResult(Rdc.id,'ellipse',(y0,x0),d_Sphere,a,b,V_Ellipsoid,timestep,None,None,tuple(Rdc.center),int(pixel_count),params)
+
+def reconstructBubbles(labels,metric,model=None,useRDC=True,timestep=0,fastProps=False,lock=None,margin=ROI_MARGIN,n_rays=64):
+    """ Reconstructs all bubbles of a label image without side effects.
+
+    No plotting, no global random state and no shared mutable objects, so several frames can be
+    reconstructed concurrently in threads (the ray kernels release the GIL).
+
+    Parameters
+    ----------
+    labels : ndarray
+        Label image (e.g. StarDist instances), 0 is background.
+    metric: float
+        Real pixel size to calculate physical sizes.
+    model:
+        RDC model (Keras), all touching bubbles of the frame are predicted in one batch.
+    useRDC: bool
+        Reconstruct touching bubbles with the RDC model, otherwise fit ellipses.
+    timestep: float
+        Timestep stored in the results.
+    fastProps: bool
+        Use the analytic ray descriptors (utils_Descriptors) instead of the point pair searches.
+    lock:
+        Optional lock held during the model call.
+    margin: int
+        Margin of the per-bubble crops (utils_ROI), None to work on the full frame.
+    n_rays: int
+        Rays per bubble, must match the input size of the RDC model (see utils_Sweep).
+
+    Returns
+    -------
+    tuple
+        BubbleResult of every reconstructed bubble in ID order, see resultsToBubbles/visualItems.
+    """
+    objs=labelRays(labels,n_rays,margin)
+    pixel_counts=np.bincount(np.asarray(labels).ravel())
+    if useRDC and model is not None:
+        return tuple(rdcResults(objs,predictRays(objs,model,metric,lock),pixel_counts,metric,timestep,fastProps))
+    results=[ellipseResult(Rdc,pixel_counts[Rdc.id],metric,timestep) for Rdc in objs]
+    return tuple(r for r in results if r is not None)
+
+def resultsToBubbles(results):
+    """ Bubble objects (for CSV export etc.) of reconstruction results. """
+    return [Bubble(None,None,Diameter=r.Diameter,Position=r.Position,Major=r.Major,Minor=r.Minor,Volume=r.Volume,
+                   Timestep=r.Timestep,ID=r.ID,Rays=r.Rays) for r in results]
+
+def visualItems(results,rng=None):
+    """ VisualItems (utils_Plot, utils_Render) of reconstruction results. Colors are drawn from
+    rng (np.random.Generator or seed), never from the global random state.
+    """
+    rng=np.random.default_rng(rng)
+    VisualItems=[]
+    for r in results:
+        random_color=tuple(rng.choice(255,size=3)/255)
+        if r.Kind=='rdc':
+            VisualItems.append({
+                'type': 'rdc',
+                'points': np.array(r.Points),
+                'center': r.Center,
+                'dists': np.array(r.Rays),
+                'pixel_count': r.PixelCount,
+                'color': random_color,
+            })
+        else:
+            VisualItems.append({
+                'type': 'ellipse',
+                'params': r.Ellipse,
+                'color': random_color
+            })
+    return VisualItems
+
+def HiddenReco(labels,metric,timestep=0,useRDC=False,model=None,boolPlot=False,ax=None,OnlyPoints=False,step_plot=True,return_visuals=False,fastProps=False,n_rays=64):
+    # Plotting wrapper around reconstructBubbles, kept for the notebooks and scripts
+    if ax is None and boolPlot and not return_visuals:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+    results=reconstructBubbles(labels,metric,model=model,useRDC=useRDC,timestep=timestep,fastProps=fastProps,n_rays=n_rays)
+    VisualItems=visualItems(results) if boolPlot else []
+    if OnlyPoints:
+        Bubbles=[(r.ID,np.array(r.Points[:,:2])) if r.Kind=='rdc' else resultsToBubbles([r])[0] for r in results]
+    else:
+        Bubbles=resultsToBubbles(results)
     
     if return_visuals:
         return Bubbles, VisualItems
 
-    if boolPlot and step_plot and VisualItems:
-        BubbleStepper(ax, VisualItems)
-    elif boolPlot and VisualItems:
-        for item in VisualItems:
-            if item['type'] == 'rdc':
-                points = item['points']
-                color = item['color']
-                a,b = list(points[:,1]),list(points[:,0])
-                a += a[:1]
-                b += b[:1]
-                ax.plot(a,b, '-', alpha=1, zorder=1, color=color, linewidth=1.5)
-
-            elif item['type'] == 'ellipse':
-                params = item['params']
-                color = item['color']
-                y0, x0, a, b, phi = params
-                ellipse = Ellipse((y0, x0), 2*a, 2*b, angle=math.degrees(phi), alpha=0.25, color=color)
-                ax.add_artist(ellipse)
+    if boolPlot and VisualItems:
+        from utils_Plot import BubbleStepper, plotVisualItems
+        if step_plot:
+            BubbleStepper(ax, VisualItems)
+        else:
+            plotVisualItems(ax, VisualItems)
                 
     return Bubbles
 
@@ -556,6 +422,7 @@ def SaveCSV_List(Bubbles,directory,name,header=None):
 #     img.save(directory+name+".png")
 
 def polygon_peri(points):
+    from skimage.draw import polygon_perimeter
     r = np.array(points[:,0])
     c = np.array(points[:,1])
     rr, cc = polygon_perimeter(r, c)
@@ -565,21 +432,12 @@ def polygon_peri(points):
     return ret_points
 
 def getMaxDistAxis(points):
-    Max_dist=0.0
-    MaxdistP1 = None
-    MaxdistP2 = None
-    
-    for i in range(len(points)):
-        for j in range(len(points)):
-            p1 = points[i]
-            p2 = points[j]
-            dist = math.sqrt((p1[0]-p2[0])**2 + (p1[1]-p2[1])**2)
-            if dist > Max_dist:
-                Max_dist = dist
-                MaxdistP1 = p1.copy()
-                MaxdistP2 = p2.copy()
-
-    return MaxdistP1,MaxdistP2
+    if len(points)==0:
+        return None,None
+    i,j=kernels.max_dist_axis(points)
+    if i<0:
+        return None,None
+    return points[i].copy(),points[j].copy()
 
 # def writeOutJSONPoints(Bubbles,directory,name):
 #     Bubbles_dict=[]
@@ -595,4 +453,11 @@ def getMaxDistAxis(points):
 #         Bubble_dict['XPoints']=XPoints 
 #         Bubbles_dict.append(Bubble_dict)
 #     with open(directory+name+'.json',"w") as out:
-#         json.dump(Bubbles_dict,out,indent=1)
\ No newline at end of file
+#         json.dump(Bubbles_dict,out,indent=1)
+
+def __getattr__(name):
+    # BubbleStepper moved to utils_Plot, keep "from utils_StarBub import BubbleStepper" working
+    if name in ('BubbleStepper', 'plotVisualItems'):
+        import utils_Plot
+        return getattr(utils_Plot, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
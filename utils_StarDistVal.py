@@ -0,0 +1,172 @@
+"""
+Fast StarDist validation during training.
+
+ValidationEngine replaces the serial predict_instances loop of MatchingEvalCallback:
+
+- n_tiles is guessed once per image shape and cached,
+- images that need no tiling are grouped by shape and pushed through the CNN in batches,
+- NMS and polygon rasterization (stardist.nms / stardist.geometry) run in a process pool,
+- matching_dataset evaluates all thresholds at once (parallel=True),
+- optionally only a fixed random subset of the validation set is used, and in async mode
+  everything after the forward pass overlaps with the next training epochs.
+"""
+
+import multiprocessing
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, Future
+
+TAUS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+
+
+def postprocess(prob, dist, shape, grid, prob_thresh, nms_thresh):
+    """ Label image of one prediction, same steps as StarDist2D.predict_instances. """
+    from stardist.nms import non_maximum_suppression
+    from stardist.geometry import polygons_to_label
+    points, probi, disti = non_maximum_suppression(dist, prob, grid=grid, prob_thresh=prob_thresh,
+                                                   nms_thresh=nms_thresh)
+    return polygons_to_label(disti, points, prob=probi, shape=shape)
+
+
+class ValidationEngine:
+    """ Batched forward pass + pooled postprocessing + matching of a StarDist validation set.
+
+    Parameters
+    ----------
+    sd_model : StarDist2D
+        Model being trained.
+    X_val, Y_val: list
+        Normalized validation images and GT labels.
+    taus: tuple
+        IoU thresholds for matching_dataset.
+    subset: int
+        Evaluate only this many images, drawn once (fixed for all epochs) with seed.
+    n_workers: int
+        Postprocessing processes.
+    batch_size: int
+        Images per CNN batch.
+    """
+
+    def __init__(self, sd_model, X_val, Y_val, taus=TAUS, subset=None, seed=0, n_workers=None, batch_size=4):
+        self.model_sd = sd_model
+        self.taus = list(taus)
+        self.batch_size = batch_size
+        index = np.arange(len(X_val))
+        if subset is not None and subset < len(X_val):
+            index = np.sort(np.random.default_rng(seed).choice(len(X_val), subset, replace=False))
+        self.index = index
+        self.X_val = [X_val[i] for i in index]
+        self.Y_val = [Y_val[i] for i in index]
+        self.n_tiles = {}
+        self.pool = ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context('spawn'))
+        self.groups = self._groupByShape()
+
+    def _tiles(self, x):
+        key = x.shape
+        if key not in self.n_tiles:
+            self.n_tiles[key] = tuple(self.model_sd._guess_n_tiles(x))
+        return self.n_tiles[key]
+
+    def _groupByShape(self):
+        groups, tiled = {}, []
+        for i, x in enumerate(self.X_val):
+            if all(t == 1 for t in self._tiles(x)):
+                groups.setdefault(x.shape, []).append(i)
+            else:
+                tiled.append(i)
+        return list(groups.values()), tiled
+
+    def _forwardBatch(self, xs):
+        from stardist.models.base import StarDistPadAndCropResizer
+        model = self.model_sd
+        grid = dict(zip('YX', model.config.grid))
+        div_by = model._axes_div_by('YXC')
+        resizers, batch = [], []
+        for x in xs:
+            x = x[..., np.newaxis] if x.ndim == 2 else x
+            resizer = StarDistPadAndCropResizer(grid=grid)
+            batch.append(resizer.before(x, 'YXC', div_by))
+            resizers.append(resizer)
+        out = model.keras_model.predict(np.stack(batch), batch_size=self.batch_size, verbose=0)
+        for resizer, prob, dist in zip(resizers, out[0], out[1]):
+            yield resizer.after(prob, 'YXC')[..., 0], np.maximum(1e-3, resizer.after(dist, 'YXC'))
+
+    def forward(self, only=None):
+        """ (prob, dist) of every validation image (or of the indices in only, others None), in
+        order. Must run on the training thread.
+        """
+        raw = [None] * len(self.X_val)
+        groups, tiled = self.groups
+        if only is not None:
+            groups = [[i for i in idx if i in only] for idx in groups]
+            tiled = [i for i in tiled if i in only]
+        for idx in groups:
+            for start in range(0, len(idx), self.batch_size):
+                chunk = idx[start:start + self.batch_size]
+                for i, pd in zip(chunk, self._forwardBatch([self.X_val[i] for i in chunk])):
+                    raw[i] = pd
+        for i in tiled:
+            x = self.X_val[i]
+            raw[i] = self.model_sd.predict(x, n_tiles=self._tiles(x), show_tile_progress=False)[:2]
+        return raw
+
+    def _finish(self, raw):
+        from stardist.matching import matching_dataset
+        model = self.model_sd
+        grid = tuple(model.config.grid)
+        futures = [self.pool.submit(postprocess, prob, dist, x.shape[:2], grid, model.thresholds.prob,
+                                    model.thresholds.nms) for (prob, dist), x in zip(raw, self.X_val)]
+        Y_pred = [f.result() for f in futures]
+        return matching_dataset(self.Y_val, Y_pred, thresh=self.taus, show_progress=False, parallel=True)
+
+    def evaluate(self):
+        """ matching_dataset stats for all taus (list in tau order). """
+        return self._finish(self.forward())
+
+    def submit(self):
+        """ Forward pass now, postprocessing and matching in the background; returns a Future. """
+        raw = self.forward()
+        future = Future()
+
+        def _run():
+            try:
+                future.set_result(self._finish(raw))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=_run, daemon=True).start()
+        return future
+
+    def checkEquivalence(self, n_images=3):
+        """ Compares the engine with the per-image model.predict_instances of the old callback on
+        the first n_images validation images.
+
+        The engine batches the CNN forward pass and runs the dense non_maximum_suppression, while
+        predict_instances predicts image by image and uses the sparse NMS; both keep the candidates
+        above the probability threshold and apply the same NMS and rasterization. Returns a dict
+        with the images whose label images differ and the matching stats (all taus) of both
+        paths on these images, which should be equal.
+        """
+        from stardist.matching import matching_dataset
+        model = self.model_sd
+        only = set(range(min(n_images, len(self.X_val))))
+        raw = self.forward(only)
+        grid = tuple(model.config.grid)
+        engine, reference, differ = [], [], []
+        for i in sorted(only):
+            x = self.X_val[i]
+            prob, dist = raw[i]
+            engine.append(postprocess(prob, dist, x.shape[:2], grid, model.thresholds.prob, model.thresholds.nms))
+            reference.append(model.predict_instances(x, n_tiles=self._tiles(x), show_tile_progress=False)[0])
+            if engine[-1].shape != reference[-1].shape or np.any((engine[-1] > 0) != (reference[-1] > 0)) or \
+                    len(np.unique(engine[-1])) != len(np.unique(reference[-1])):
+                differ.append(int(self.index[i]))
+        Y = [self.Y_val[i] for i in sorted(only)]
+        stats = {name: matching_dataset(Y, pred, thresh=self.taus, show_progress=False)
+                 for name, pred in (('engine', engine), ('predict_instances', reference))}
+        equal = all(a._asdict() == b._asdict() for a, b in zip(stats['engine'], stats['predict_instances']))
+        return {'images': [int(self.index[i]) for i in sorted(only)], 'differing_images': differ,
+                'stats_equal': equal, 'stats': stats}
+
+    def close(self):
+        self.pool.shutdown()
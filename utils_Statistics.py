@@ -0,0 +1,223 @@
+"""
+Streaming bubble size distributions for long runs.
+
+SizeDistribution consumes the per-frame output of HiddenReco/reconstructBubbles incrementally and
+keeps fixed-bin histograms, running moments and per-timestep-window statistics (the latest
+max_windows windows), so memory does not grow with the number of bubbles or frames. Partial
+states of parallel workers are combined with merge.
+
+    stats = SizeDistribution(window=100)
+    for t, labels in enumerate(frames):
+        stats.update(HiddenReco(labels, metric, timestep=t, useRDC=True, model=model), t)
+    print(stats.summary()['Diameter'])
+"""
+
+import numpy as np
+
+# Default histogram edges, sizes in the units of metric (mm for the shipped models)
+DEFAULT_EDGES = {
+    'Diameter': np.linspace(0, 10, 201),
+    'Volume': np.geomspace(1e-4, 1e3, 141),
+    'Aspect': np.linspace(1, 5, 161),
+    'PixelCount': np.geomspace(1, 1e6, 121),
+}
+
+
+class RunningMoments:
+    """ Count, mean, variance, min, max and power sums of a stream of values.
+
+    Batches are combined with the parallel form of Welford's algorithm (Chan et al.), which is
+    also used by merge.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.M2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.sum2 = 0.0
+        self.sum3 = 0.0
+
+    def _combine(self, n, mean, M2, vmin, vmax, sum2, sum3):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.M2 += M2 + delta**2 * self.n * n / total
+        self.n = total
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+        self.sum2 += sum2
+        self.sum3 += sum3
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        mean = values.mean()
+        self._combine(values.size, mean, np.sum((values - mean)**2), values.min(), values.max(),
+                      np.sum(values**2), np.sum(values**3))
+
+    def merge(self, other):
+        self._combine(other.n, other.mean, other.M2, other.min, other.max, other.sum2, other.sum3)
+        return self
+
+    @property
+    def var(self):
+        return self.M2 / (self.n - 1) if self.n > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def summary(self):
+        if self.n == 0:
+            return {'count': 0}
+        return {'count': self.n, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max}
+
+
+def histQuantiles(edges, counts, q, underflow=0, overflow=0):
+    """ Quantiles (q in [0, 1]) of a fixed-bin histogram, linear within a bin.
+
+    Under-/overflow counts are part of the total, quantiles that fall into them are clipped to
+    the first/last edge. Returns (quantiles, clipped) with clipped a bool array per q.
+    """
+    q = np.asarray(q, dtype=np.float64)
+    cum = np.concatenate([[0, underflow], underflow + np.cumsum(counts)]).astype(np.float64)
+    cum = np.append(cum, cum[-1] + overflow)
+    if cum[-1] == 0:
+        return np.full(q.shape, np.nan), np.zeros(q.shape, dtype=bool)
+    xs = np.concatenate([[edges[0]], edges, [edges[-1]]])
+    target = q * cum[-1]
+    clipped = (target < underflow) | (target > cum[-1] - overflow)
+    return np.interp(target, cum, xs), clipped
+
+
+def bubbleArrays(bubbles):
+    """ Diameter, Volume, Aspect (Major/Minor >= 1) and PixelCount arrays of Bubble/BubbleResult lists.
+
+    Bubbles without a diameter are dropped, PixelCount is only returned if all bubbles have one.
+    """
+    rows = [b for b in bubbles if getattr(b, 'Diameter', None) is not None]
+    values = {
+        'Diameter': np.array([b.Diameter for b in rows], dtype=np.float64),
+        'Volume': np.array([b.Volume for b in rows], dtype=np.float64),
+    }
+    major = np.array([b.Major for b in rows], dtype=np.float64)
+    minor = np.array([b.Minor for b in rows], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values['Aspect'] = np.maximum(major, minor) / np.minimum(major, minor)
+    if rows and all(getattr(b, 'PixelCount', None) is not None for b in rows):
+        values['PixelCount'] = np.array([b.PixelCount for b in rows], dtype=np.float64)
+    return values
+
+
+class SizeDistribution:
+    """ Mergeable streaming aggregator of bubble size, volume and aspect ratio distributions.
+
+    Parameters
+    ----------
+    edges : dict
+        Histogram edges per quantity (Diameter, Volume, Aspect, PixelCount), defaults to
+        DEFAULT_EDGES. Values outside the edges are counted as under-/overflow.
+    window: int
+        Width of the timestep windows for the windowed statistics, None to disable them.
+    max_windows: int
+        Only the latest max_windows windows are kept (memory stays bounded on endless runs),
+        older ones are dropped and counted in dropped_windows. None keeps all.
+    """
+
+    def __init__(self, edges=None, window=100, max_windows=1000):
+        self.edges = {k: np.asarray(v, dtype=np.float64) for k, v in (edges or DEFAULT_EDGES).items()}
+        self.window = window
+        self.max_windows = max_windows
+        self.dropped_windows = 0
+        self.counts = {k: np.zeros(len(e) + 1, dtype=np.int64) for k, e in self.edges.items()}
+        self.moments = {k: RunningMoments() for k in self.edges}
+        self.windows = {}
+        self.frames = 0
+        self.bubbles = 0
+
+    def _add(self, values, moments, counts=None):
+        for key, v in values.items():
+            if key not in self.edges:
+                continue
+            v = v[np.isfinite(v)]
+            moments[key].update(v)
+            if counts is not None:
+                # Index 0 is underflow, len(edges) overflow (right edge inclusive as np.histogram)
+                idx = np.searchsorted(self.edges[key], v, side='right')
+                idx[v == self.edges[key][-1]] -= 1
+                counts[key] += np.bincount(idx, minlength=len(counts[key]))
+
+    def update(self, bubbles, timestep=None):
+        """ Adds the bubbles of one frame, timestep defaults to the Timestep of the bubbles. """
+        values = bubbleArrays(bubbles)
+        self.frames += 1
+        self.bubbles += len(values['Diameter'])
+        self._add(values, self.moments, self.counts)
+        if self.window is not None:
+            if timestep is None:
+                timestep = bubbles[0].Timestep if len(bubbles) else 0
+            w = int(timestep // self.window)
+            state = self.windows.setdefault(w, {'frames': 0, 'moments': {k: RunningMoments() for k in self.edges}})
+            state['frames'] += 1
+            self._add(values, state['moments'])
+            self._trimWindows()
+        return self
+
+    def _trimWindows(self):
+        if self.max_windows is None or len(self.windows) <= self.max_windows:
+            return
+        for w in sorted(self.windows)[:len(self.windows) - self.max_windows]:
+            del self.windows[w]
+            self.dropped_windows += 1
+
+    def merge(self, other):
+        """ Adds the state of another aggregator with the same edges and window. """
+        if self.window != other.window or self.edges.keys() != other.edges.keys() or \
+                any(not np.array_equal(self.edges[k], other.edges[k]) for k in self.edges):
+            raise ValueError("Cannot merge SizeDistributions with different edges or windows")
+        for k in self.edges:
+            self.counts[k] += other.counts[k]
+            self.moments[k].merge(other.moments[k])
+        for w, state in other.windows.items():
+            mine = self.windows.setdefault(w, {'frames': 0, 'moments': {k: RunningMoments() for k in self.edges}})
+            mine['frames'] += state['frames']
+            for k in self.edges:
+                mine['moments'][k].merge(state['moments'][k])
+        self.frames += other.frames
+        self.bubbles += other.bubbles
+        self.dropped_windows += other.dropped_windows
+        self._trimWindows()
+        return self
+
+    def histogram(self, key):
+        """ (counts, edges) of a quantity without the under-/overflow bins. """
+        return self.counts[key][1:-1].copy(), self.edges[key]
+
+    def summary(self, quantiles=(0.1, 0.5, 0.9)):
+        """ Moments, histogram quantiles and under-/overflow per quantity, the Sauter mean
+        diameter D32 and the windowed statistics as a list ordered by timestep.
+        """
+        result = {'frames': self.frames, 'bubbles': self.bubbles, 'dropped_windows': self.dropped_windows}
+        for k in self.edges:
+            entry = self.moments[k].summary()
+            counts, edges = self.histogram(k)
+            values, clipped = histQuantiles(edges, counts, quantiles, self.counts[k][0], self.counts[k][-1])
+            entry['quantiles'] = {q: float(v) for q, v in zip(quantiles, values)}
+            # Quantiles inside the under-/overflow, their value is the first/last edge
+            entry['clipped'] = [q for q, c in zip(quantiles, clipped) if c]
+            entry['underflow'] = int(self.counts[k][0])
+            entry['overflow'] = int(self.counts[k][-1])
+            result[k] = entry
+        d = self.moments['Diameter'] if 'Diameter' in self.moments else None
+        result['D32'] = d.sum3 / d.sum2 if d is not None and d.sum2 > 0 else np.nan
+        result['windows'] = [
+            dict({'start': w * self.window, 'end': (w + 1) * self.window, 'frames': state['frames']},
+                 **{k: m.summary() for k, m in state['moments'].items()})
+            for w, state in sorted(self.windows.items())
+        ]
+        return result
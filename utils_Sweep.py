@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Parallel RDC hyperparameter and ray count sweep.
+
+Trains several build_rdc_model configurations (hidden width, depth, ray count, learning rate,
+batch size) in CPU worker processes against one memory-mapped copy of the training data. The
+data is shuffled once into a cache next to the results (shuffledCache), then every worker opens it
+with np.load(mmap_mode='r') and trains from a batch generator over contiguous slices, so the OS
+page cache holds the dataset once for all workers and each worker only keeps a batch in memory.
+Each configuration reports the mean area accuracy on the validation split (as
+calculate_area_accuracy in rdc-train.ipynb) and the measured latency of the batched model.predict
+used by reconstructBubbles, to pick the accuracy/throughput tradeoff for deployment.
+
+Lower ray counts are taken from the 64 ray data by subsampling: ray k of n rays has the angle of
+ray k * 64 / n, and rays are stretched independently, so the subsampled rays are exactly those
+RDObj(id, n) computes (use reconstructBubbles(..., n_rays=n) with such a model).
+
+    python utils_Sweep.py data/RDC/Synthetic_RDC/Array-64-0.052 --hidden 16 32 64 --layers 2 3 --rays 32 64
+"""
+
+import os
+import csv
+import uuid
+import json
+import time
+import random
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from utils_Descriptors import areaAccuracy
+
+BASE_CONFIG = {'hidden_dim': 64, 'num_hidden_layers': 3, 'n_rays': 64, 'learning_rate': 1e-4,
+               'batch_size': 1400, 'epochs': 1000}
+LATENCY_BATCHES = (32, 4096)
+
+
+def writeAtomic(path, payload):
+    """ Writes payload as JSON to path via a temporary file and os.replace. """
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+def build_rdc_model(input_dim, hidden_dim, output_dim, num_hidden_layers, learning_rate, verbose=False):
+    """ Dense RDC net of rdc-train.ipynb (ReLU hidden layers, linear output, Adam, MSE). """
+    from tensorflow.keras import layers, models, optimizers
+    model = models.Sequential()
+    model.add(layers.InputLayer(input_shape=(input_dim,)))
+    for _ in range(num_hidden_layers):
+        model.add(layers.Dense(hidden_dim, activation='relu'))
+    model.add(layers.Dense(output_dim))
+    model.compile(optimizer=optimizers.Adam(learning_rate=learning_rate), loss='mse', metrics=['mae'])
+    if verbose:
+        model.summary()
+    return model
+
+
+def subsampleRays(A, n_rays):
+    """ Columns of an (N, 64) ray matrix for n_rays equally spaced rays (64 % n_rays == 0). """
+    total = A.shape[1]
+    if total % n_rays:
+        raise ValueError(f"{n_rays} rays are not a subset of {total} rays")
+    return A[:, ::total // n_rays]
+
+
+def sweepGrid(**values):
+    """ All combinations of the given parameter lists on top of BASE_CONFIG, e.g.
+    sweepGrid(hidden_dim=[16, 32], n_rays=[32, 64]).
+    """
+    keys = list(values)
+    return [dict(BASE_CONFIG, **dict(zip(keys, combo))) for combo in itertools.product(*values.values())]
+
+
+def configName(config):
+    return (f"h{config['hidden_dim']}_l{config['num_hidden_layers']}_r{config['n_rays']}"
+            f"_lr{config['learning_rate']:g}_b{config['batch_size']}_e{config['epochs']}")
+
+
+def runKey(config, cache_meta, seed, val_split):
+    """ Everything a result depends on: the configuration, the training data (path, mtime and
+    shape of X_train.npy), the seed and the validation split. Stored in every result row.
+    """
+    return dict(config, data_dir=cache_meta['source'], data_mtime=cache_meta['mtime'],
+                data_rows=cache_meta['shape'][0], seed=seed, val_split=val_split)
+
+
+def shuffledCache(data_dir, cache_dir, seed=0, chunk=65536):
+    """ Seeded, shuffled copy of X_train.npy/Y_train.npy in cache_dir (made once, reused by
+    later sweeps with the same data and seed), so train and validation split are contiguous slices.
+    Returns the cache description (source, seed, shape, mtime) stored in cache_dir/cache.json.
+    """
+    X = np.load(os.path.join(data_dir, 'X_train.npy'), mmap_mode='r')
+    Y = np.load(os.path.join(data_dir, 'Y_train.npy'), mmap_mode='r')
+    meta = {'source': os.path.abspath(data_dir), 'seed': seed, 'shape': list(X.shape),
+            'mtime': max(os.stat(os.path.join(data_dir, n)).st_mtime for n in ('X_train.npy', 'Y_train.npy'))}
+    meta_path = os.path.join(cache_dir, 'cache.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return meta
+    os.makedirs(cache_dir, exist_ok=True)
+    perm = np.random.default_rng(seed).permutation(len(X))
+    for name, A in (('X_train.npy', X), ('Y_train.npy', Y)):
+        out = np.lib.format.open_memmap(os.path.join(cache_dir, name), mode='w+', dtype=np.float32, shape=A.shape)
+        for start in range(0, len(A), chunk):
+            idx = perm[start:start + chunk]
+            order = np.argsort(idx)
+            # Sorted reads from the source memmap, scattered back into shuffled order
+            out[start:start + len(idx)][order] = A[idx[order]]
+        out.flush()
+        del out
+    writeAtomic(meta_path, meta)
+    return meta
+
+
+def batchGenerator(X, Y, batch_size, n_rays, shuffle=True, seed=0):
+    """ Endless (X, Y) batches read from memmaps, only one batch is in memory at a time.
+
+    The data is shuffled once on disk (shuffledCache), per epoch only the batch order changes.
+    """
+    n_batches = (len(X) + batch_size - 1) // batch_size
+    rng = np.random.default_rng(seed)
+    while True:
+        order = rng.permutation(n_batches) if shuffle else np.arange(n_batches)
+        for b in order:
+            s = slice(b * batch_size, (b + 1) * batch_size)
+            yield np.asarray(subsampleRays(X[s], n_rays)), np.asarray(subsampleRays(Y[s], n_rays))
+
+
+def measureLatency(model, X, batches=LATENCY_BATCHES, repeats=10):
+    """ Median seconds of model.predict(X_batch, batch_size=4096) per batch size, as the RDC
+    reconstruction of one frame calls it.
+    """
+    latency = {}
+    for n in batches:
+        Xb = np.resize(X, (n, X.shape[1])).astype(np.float32)
+        model.predict(Xb, batch_size=4096, verbose=0)
+        times = []
+        for _ in range(repeats):
+            t = time.perf_counter()
+            model.predict(Xb, batch_size=4096, verbose=0)
+            times.append(time.perf_counter() - t)
+        latency[n] = float(np.median(times))
+    return latency
+
+
+def _initWorker(threads):
+    # Before TensorFlow is imported: CPU only and a fixed number of threads per worker
+    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    if threads:
+        os.environ['OMP_NUM_THREADS'] = str(threads)
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def trainConfig(config, cache_dir, n_val, seed=0, model_dir=None, patience=100):
+    """ Trains one configuration on the shuffled cache (last n_val rows validate, as the
+    validation_split of rdc-train.ipynb) and returns its result row (config, accuracy, latencies).
+    """
+    import tensorflow as tf
+    X = np.load(os.path.join(cache_dir, 'X_train.npy'), mmap_mode='r')
+    Y = np.load(os.path.join(cache_dir, 'Y_train.npy'), mmap_mode='r')
+    n_train = len(X) - n_val
+    X_train, Y_train, X_val, Y_val = X[:n_train], Y[:n_train], X[n_train:], Y[n_train:]
+    n_rays = config['n_rays']
+    batch_size = config['batch_size']
+    # tf.keras.utils.set_random_seed needs TF >= 2.7, requirements pin 2.4
+    tf.random.set_seed(seed)
+    np.random.seed(seed)
+    random.seed(seed)
+    model = build_rdc_model(n_rays, config['hidden_dim'], n_rays, config['num_hidden_layers'],
+                            config['learning_rate'])
+    callbacks = [
+        tf.keras.callbacks.EarlyStopping(monitor='val_loss', min_delta=0.001, patience=patience,
+                                         restore_best_weights=True),
+        tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=20, min_lr=1e-6),
+    ]
+    t = time.perf_counter()
+    history = model.fit(batchGenerator(X_train, Y_train, batch_size, n_rays, seed=seed),
+                        steps_per_epoch=(n_train + batch_size - 1) // batch_size, epochs=config['epochs'],
+                        validation_data=batchGenerator(X_val, Y_val, 4096, n_rays, shuffle=False),
+                        validation_steps=(n_val + 4095) // 4096, callbacks=callbacks, verbose=0)
+    train_seconds = time.perf_counter() - t
+    accuracies = []
+    for x, y in itertools.islice(batchGenerator(X_val, Y_val, 65536, n_rays, shuffle=False), (n_val + 65535) // 65536):
+        accuracies.append(areaAccuracy(y, model.predict(x, batch_size=4096, verbose=0)))
+    name = configName(config)
+    if model_dir is not None:
+        os.makedirs(model_dir, exist_ok=True)
+        model.save(os.path.join(model_dir, f"rdc_{name}.h5"))
+    row = dict(config, name=name, params=int(model.count_params()), epochs_run=len(history.history['loss']),
+               val_loss=float(np.min(history.history['val_loss'])),
+               area_accuracy=float(np.mean(np.concatenate(accuracies))), train_seconds=train_seconds)
+    for n, seconds in measureLatency(model, np.asarray(subsampleRays(X_val[:4096], n_rays))).items():
+        row[f"latency_{n}"] = seconds
+    return row
+
+
+def paretoFront(rows, latency_key=f"latency_{LATENCY_BATCHES[-1]}"):
+    """ Names of the rows no other row beats in both area accuracy and latency. """
+    front = []
+    for r in rows:
+        if not any(o['area_accuracy'] >= r['area_accuracy'] and o[latency_key] <= r[latency_key] and
+                   (o['area_accuracy'] > r['area_accuracy'] or o[latency_key] < r[latency_key]) for o in rows):
+            front.append(r['name'])
+    return front
+
+
+def runSweep(data_dir, configs, out_dir, n_workers=None, threads_per_worker=None, val_split=0.1, seed=0,
+             save_models=False, patience=100):
+    """ Trains all configs in a process pool and writes results.csv/results.json to out_dir.
+
+    Every finished configuration is stored in out_dir/runs/<name>.json right away, a rerun skips
+    configurations whose stored result has the same runKey (same data, seed and validation split)
+    and retrains the others. Returns the rows sorted by area accuracy.
+    """
+    run_dir = os.path.join(out_dir, 'runs')
+    os.makedirs(run_dir, exist_ok=True)
+    model_dir = os.path.join(out_dir, 'models') if save_models else None
+    n_workers = n_workers or max(1, min(len(configs), (os.cpu_count() or 1) // 2))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // n_workers)
+    cache_dir = os.path.join(out_dir, 'cache')
+    cache_meta = shuffledCache(data_dir, cache_dir, seed)
+    n_val = int(cache_meta['shape'][0] * val_split)
+    rows, todo = [], []
+    for config in configs:
+        key = runKey(config, cache_meta, seed, val_split)
+        path = os.path.join(run_dir, configName(config) + '.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                row = json.load(f)
+            if {k: row.get(k) for k in key} == key:
+                rows.append(row)
+                continue
+        todo.append(config)
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(n_workers, mp_context=ctx, initializer=_initWorker, initargs=(threads_per_worker,)) as ex:
+        futures = [ex.submit(trainConfig, config, cache_dir, n_val, seed, model_dir, patience) for config in todo]
+        for config, fut in zip(todo, futures):
+            row = dict(fut.result(), **runKey(config, cache_meta, seed, val_split))
+            writeAtomic(os.path.join(run_dir, row['name'] + '.json'), row)
+            rows.append(row)
+            print(f"{row['name']}: area accuracy {row['area_accuracy']:.4f}, "
+                  f"{row[f'latency_{LATENCY_BATCHES[-1]}'] * 1e3:.1f} ms per {LATENCY_BATCHES[-1]} rays")
+    rows.sort(key=lambda r: -r['area_accuracy'])
+    front = set(paretoFront(rows))
+    for r in rows:
+        r['pareto'] = r['name'] in front
+    writeAtomic(os.path.join(out_dir, 'results.json'), rows)
+    with open(os.path.join(out_dir, 'results.csv'), 'w', newline='') as f:
+        wr = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else [])
+        wr.writeheader()
+        wr.writerows(rows)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel RDC hyperparameter / ray count sweep')
+    parser.add_argument('data', help='directory with X_train.npy and Y_train.npy (64 rays)')
+    parser.add_argument('--out', default=os.path.abspath('logs/rdc_sweep'))
+    parser.add_argument('--hidden', type=int, nargs='+', default=[BASE_CONFIG['hidden_dim']])
+    parser.add_argument('--layers', type=int, nargs='+', default=[BASE_CONFIG['num_hidden_layers']])
+    parser.add_argument('--rays', type=int, nargs='+', default=[BASE_CONFIG['n_rays']])
+    parser.add_argument('--lr', type=float, nargs='+', default=[BASE_CONFIG['learning_rate']])
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[BASE_CONFIG['batch_size']])
+    parser.add_argument('--epochs', type=int, default=BASE_CONFIG['epochs'])
+    parser.add_argument('--patience', type=int, default=100)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads', type=int, help='TensorFlow threads per worker')
+    parser.add_argument('--save-models', action='store_true')
+    args = parser.parse_args()
+
+    configs = sweepGrid(hidden_dim=args.hidden, num_hidden_layers=args.layers, n_rays=args.rays,
+                        learning_rate=args.lr, batch_size=args.batch_size, epochs=[args.epochs])
+    rows = runSweep(args.data, configs, args.out, args.workers, args.threads, save_models=args.save_models,
+                    patience=args.patience)
+    for r in rows:
+        print(f"{'*' if r['pareto'] else ' '} {r['name']:32s} acc {r['area_accuracy']:.4f}  "
+              f"latency {r[f'latency_{LATENCY_BATCHES[-1]}'] * 1e3:.1f} ms  params {r['params']}")
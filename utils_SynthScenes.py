@@ -0,0 +1,256 @@
+"""
+Synthetic overlapping bubble scenes for RDC training and evaluation.
+
+Composes the deduplicated unique bubbles (Synth_Unique) into label scenes with a target void
+fraction (alpha) and occlusion ratio and emits the masks, their metadata and the X/Y ray pairs
+of generate_training_data (rdc-data-gen) in one pass, without intermediate PNGs.
+
+Placement is vectorized: for a new bubble the overlap with the current scene and the part
+inside the frame are computed for every offset at once by FFT correlation, and the offset is
+drawn from all positions that meet the occlusion target. Bubbles are painted in z order, every
+new bubble goes behind the bubbles already placed, so its occlusion is fixed at placement time
+and does not change afterwards.
+"""
+
+import os
+import glob
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from utils_StarBub import RDObj
+
+IMG_SIZE = (256, 256)
+TARGET_PAD = 10
+
+# Per worker process bubble library, set by _initWorker
+_library = None
+
+
+def loadUniqueBubbles(unique_dir):
+    """ Names and bounding box crops (bool) of all unique bubble images, sorted by name. """
+    from PIL import Image
+    names, crops = [], []
+    for path in sorted(glob.glob(os.path.join(unique_dir, '*.png'))):
+        arr = np.array(Image.open(path)) > 128
+        rows, cols = np.nonzero(arr)
+        if len(rows) == 0:
+            continue
+        names.append(os.path.basename(path))
+        crops.append(arr[rows.min():rows.max() + 1, cols.min():cols.max() + 1])
+    return names, crops
+
+
+def _occlusionRange(occlusion):
+    if np.ndim(occlusion) == 0:
+        return max(0.0, occlusion - 0.05), min(1.0, occlusion + 0.05)
+    return tuple(occlusion)
+
+
+def placementMaps(composition, crop, edge_margin=0.2):
+    """ Overlap with the scene and area inside the frame of crop for every top-left offset.
+
+    Returns (overlap, inside, r0, c0): arrays over all offsets r in [r0, H - h + margin],
+    c in [c0, W - w + margin] (r0, c0 negative, the crop may leave the frame by edge_margin).
+    """
+    from scipy.signal import fftconvolve
+    H, W = composition.shape
+    h, w = crop.shape
+    mh, mw = int(h * edge_margin), int(w * edge_margin)
+    pad = ((mh, mh), (mw, mw))
+    kernel = crop[::-1, ::-1].astype(np.float32)
+    overlap = fftconvolve(np.pad(composition.astype(np.float32), pad), kernel, mode='valid')
+    inside = fftconvolve(np.pad(np.ones((H, W), dtype=np.float32), pad), kernel, mode='valid')
+    return np.rint(overlap), np.rint(inside), -mh, -mw
+
+
+def composeScene(crops, rng, img_size=IMG_SIZE, alpha=0.2, occlusion=(0.1, 0.6), min_bubbles=2, max_bubbles=24,
+                 max_retries=20, edge_margin=0.2, min_inside=0.8):
+    """ Composes one overlapping scene.
+
+    Parameters
+    ----------
+    crops : list
+        Bool bubble crops (loadUniqueBubbles).
+    rng: np.random.Generator
+        Source of all randomness.
+    alpha: float
+        Target void fraction, bubbles are added until this fraction of the frame is covered.
+    occlusion: float or tuple
+        Occlusion ratio (hidden fraction) of every bubble behind the first, a float means +-0.05.
+    min_inside: float
+        Minimum fraction of each bubble inside the frame.
+
+    Returns
+    -------
+    labels : ndarray
+        uint16 label image, IDs in placement order (front to back).
+    placements: list
+        (crop index, r, c, occlusion) per ID.
+    """
+    H, W = img_size
+    occ_lo, occ_hi = _occlusionRange(occlusion)
+    labels = np.zeros(img_size, dtype=np.uint16)
+    composition = np.zeros(img_size, dtype=bool)
+    placements = []
+    used = set()
+    retries = 0
+    while len(placements) < max_bubbles and retries < max_retries:
+        if len(placements) >= min_bubbles and np.count_nonzero(composition) >= alpha * H * W:
+            break
+        k = int(rng.integers(len(crops)))
+        if k in used:
+            retries += 1
+            continue
+        crop = crops[k]
+        area = np.count_nonzero(crop)
+        overlap, inside, r0, c0 = placementMaps(composition, crop, edge_margin)
+        # Painted behind the scene: hidden = covered by earlier bubbles or outside the frame
+        hidden = 1 - (inside - overlap) / area
+        valid = inside >= min_inside * area
+        if placements:
+            valid &= (hidden >= occ_lo) & (hidden <= occ_hi)
+        candidates = np.flatnonzero(valid)
+        if len(candidates) == 0:
+            retries += 1
+            continue
+        idx = candidates[rng.integers(len(candidates))]
+        r, c = np.unravel_index(idx, valid.shape)
+        r, c = int(r) + r0, int(c) + c0
+        h, w = crop.shape
+        sr, sc = max(r, 0), max(c, 0)
+        er, ec = min(r + h, H), min(c + w, W)
+        window = crop[sr - r:er - r, sc - c:ec - c]
+        target = labels[sr:er, sc:ec]
+        # z order: only free pixels are painted, earlier (front) bubbles stay on top
+        target[window & (target == 0)] = len(placements) + 1
+        composition[sr:er, sc:ec] |= window
+        placements.append((k, r, c, float(hidden.flat[idx])))
+        used.add(k)
+    return labels, placements
+
+
+def scenePairs(labels, placements, crops, metric, n_rays=64, min_visible=0.1):
+    """ X/Y ray pairs of a scene as in generate_training_data (rdc-data-gen).
+
+    X are the rays of the visible (occluded) bubble, Y the rays of the full bubble from the same
+    center, both times metric. Bubbles with less than min_visible of their area visible are skipped.
+    Returns X, Y and the IDs used.
+    """
+    X, Y, ids = [], [], []
+    counts = np.bincount(labels.ravel(), minlength=len(placements) + 1)
+    for i, (k, r, c, _) in enumerate(placements, start=1):
+        crop = crops[k]
+        area = np.count_nonzero(crop)
+        if area == 0 or counts[i] / area < min_visible:
+            continue
+        rdc_input = RDObj(i, n_rays)
+        rdc_input.generateRD_manual(labels)
+        if rdc_input.center is None:
+            continue
+        padded = np.pad(crop.astype(int), TARGET_PAD, mode='constant', constant_values=0)
+        local_center = (rdc_input.center[0] - r + TARGET_PAD, rdc_input.center[1] - c + TARGET_PAD)
+        rdc_target = RDObj(1, n_rays, center=local_center)
+        rdc_target.generateRD_manual(padded)
+        X.append(rdc_input.transformRDToArray(metric))
+        Y.append(rdc_target.transformRDToArray(metric))
+        ids.append(i)
+    return X, Y, ids
+
+
+def writeSample(mask_dir, sample_id, labels, placements, names, alpha):
+    """ Mask PNG and metadata CSV in the layout of the external Masks set (plus alpha/occlusion). """
+    from PIL import Image
+    Image.fromarray(labels.astype(np.uint8 if labels.max() < 256 else np.uint16)).save(
+        os.path.join(mask_dir, f"rdc_{sample_id}.png"))
+    with open(os.path.join(mask_dir, f"rdc_{sample_id}.csv"), 'w') as f:
+        f.write("pixel_value,source_bubble,r,c,alpha,occlusion\n")
+        f.write("0,background,0,0,,\n")
+        for i, (k, r, c, occ) in enumerate(placements, start=1):
+            f.write(f"{i},{names[k]},{r},{c},{alpha},{occ:.4f}\n")
+
+
+def _initWorker(unique_dir):
+    global _library
+    _library = loadUniqueBubbles(unique_dir)
+
+
+def generateChunk(sample_ids, seed, metric, alphas, occlusion, img_size=IMG_SIZE, n_rays=64, mask_dir=None,
+                  library=None, **scene_kwargs):
+    """ Composes the scenes sample_ids with an own generator (seed: SeedSequence or int).
+
+    Returns X, Y and metadata rows (sample, pixel_value, source_bubble, alpha, occlusion) of the pairs.
+    """
+    names, crops = library if library is not None else _library
+    rng = np.random.default_rng(seed)
+    X, Y, meta = [], [], []
+    for sample_id in sample_ids:
+        alpha = alphas[int(rng.integers(len(alphas)))]
+        labels, placements = composeScene(crops, rng, img_size, alpha, occlusion, **scene_kwargs)
+        if len(placements) < 2:
+            continue
+        if mask_dir is not None:
+            writeSample(mask_dir, sample_id, labels, placements, names, alpha)
+        x, y, ids = scenePairs(labels, placements, crops, metric, n_rays)
+        X.extend(x)
+        Y.extend(y)
+        meta.extend((sample_id, i, names[placements[i - 1][0]], alpha, placements[i - 1][3]) for i in ids)
+    return X, Y, meta
+
+
+def generateScenes(unique_dir, num_samples, metric=5.2E-2, alpha=(0.1, 0.2, 0.3), occlusion=(0.1, 0.6), seed=None,
+                   out_dir=None, write_masks=False, n_workers=None, chunk_size=256, n_rays=64, img_size=IMG_SIZE,
+                   **scene_kwargs):
+    """ Generates num_samples synthetic scenes in a process pool and returns their X/Y ray pairs.
+
+    Every chunk of chunk_size scenes gets its own child of SeedSequence(seed), so the result only
+    depends on seed and chunk_size, not on the number of workers.
+
+    Parameters
+    ----------
+    unique_dir : str
+        Directory of the unique bubble PNGs.
+    alpha: float or tuple
+        Target void fraction(s), each scene draws one.
+    occlusion: float or tuple
+        Occlusion ratio (range) of the bubbles behind the first one of a scene.
+    out_dir: str
+        If given, X_train.npy/Y_train.npy/meta.csv are written to out_dir/Array-64-<metric>
+        and, with write_masks, masks and CSVs to out_dir/Masks.
+
+    Returns
+    -------
+    X, Y : ndarray
+        (N, n_rays) input and target rays times metric.
+    meta: list
+        (sample, pixel_value, source_bubble, alpha, occlusion) per pair.
+    """
+    alphas = tuple(np.atleast_1d(alpha).tolist())
+    mask_dir = None
+    if out_dir is not None and write_masks:
+        mask_dir = os.path.join(out_dir, 'Masks')
+        os.makedirs(mask_dir, exist_ok=True)
+    chunks = [range(i, min(i + chunk_size, num_samples)) for i in range(0, num_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    X, Y, meta = [], [], []
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(n_workers, mp_context=ctx, initializer=_initWorker, initargs=(unique_dir,)) as ex:
+        futures = [ex.submit(generateChunk, list(ids), s, metric, alphas, occlusion, img_size, n_rays, mask_dir,
+                             **scene_kwargs) for ids, s in zip(chunks, seeds)]
+        for fut in futures:
+            x, y, m = fut.result()
+            X.extend(x)
+            Y.extend(y)
+            meta.extend(m)
+    X = np.array(X, dtype=np.float64).reshape(-1, n_rays)
+    Y = np.array(Y, dtype=np.float64).reshape(-1, n_rays)
+    if out_dir is not None:
+        array_dir = os.path.join(out_dir, f'Array-{n_rays}-' + str(metric))
+        os.makedirs(array_dir, exist_ok=True)
+        np.save(os.path.join(array_dir, 'X_train.npy'), X)
+        np.save(os.path.join(array_dir, 'Y_train.npy'), Y)
+        with open(os.path.join(array_dir, 'meta.csv'), 'w') as f:
+            f.write("sample,pixel_value,source_bubble,alpha,occlusion\n")
+            for row in meta:
+                f.write(f"{row[0]},{row[1]},{row[2]},{row[3]},{row[4]:.4f}\n")
+    print(f"Generated {len(X)} training pairs from {num_samples} scenes.")
+    return X, Y, meta